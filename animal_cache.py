@@ -0,0 +1,313 @@
+# Python module that keeps an in-memory, columnar copy of the animals collection in MongoDB.
+
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from animal_shelter import AnimalShelter, AnimalQuery
+
+
+class AnimalCache(object):
+    """ In-memory snapshot of the Animal collection kept current with MongoDB """
+
+    # Text columns with few distinct values are stored as categories so filters compare integer codes
+    category_columns = ['animal_type', 'breed', 'sex_upon_outcome', 'color',
+                        'outcome_type', 'outcome_subtype', 'age_upon_outcome', 'monthyear']
+
+    # Initialize AnimalCache object
+    # Input -> AnimalShelter used to read the collection, seconds between polls when change streams are unavailable,
+    #          whether to start following changes in a background thread, an optional snapshot file, and the
+    #          seconds between saves of a changed snapshot by the background thread.
+    #          A snapshot that exists is loaded and brought up to date instead of reading the whole collection,
+    #          otherwise the collection is read. Either way the current snapshot is saved for the next start,
+    #          again while following changes and when stopped, so the changes read on the next start stay few.
+    def __init__(self, shelter: AnimalShelter, poll_interval: float = 5.0, follow: bool = True,
+                 snapshot: str = None, save_interval: float = 300.0) -> None:
+        self.shelter = shelter
+        self.poll_interval = poll_interval
+        self.snapshot = snapshot
+        self.save_interval = save_interval
+        self.saved_version = None             # version of the snapshot last saved to the snapshot file
+        self.saved_time = time.monotonic()
+        self.lock = threading.Lock()          # serializes writers, readers use whichever frame is current
+        self.version = 0                      # increased every time the snapshot changes
+        self.data_version = 0                 # AnimalShelter data version the snapshot was taken at
+        self.frame = None
+        self.stopped = threading.Event()
+        if snapshot and os.path.exists(snapshot):
+            self.load(snapshot)
+            self.saved_version = self.version
+            self.catch_up()
+        else:
+            self.reload()
+        self._save_snapshot(force=True)
+
+        # Follow changes to the collection in the background
+        self.thread = None
+        if follow:
+            self.thread = threading.Thread(target=self._follow, name='animal-cache', daemon=True)
+            self.thread.start()
+
+    # Columns of the animal data, in collection order
+    @property
+    def columns(self) -> list:
+        return list(self.frame.columns)
+
+    # Reload method replaces the snapshot with a full read of the collection.
+    def reload(self) -> None:
+        """ Read the whole Animal collection into memory """
+        with self.lock:
+            data_version = self.shelter.version()                       # read the version first so no write is missed
+            frame = self.shelter.read_frame({}, projection={'_version': 0}, categories=self.category_columns)
+            self.frame = frame.set_index('_id') if '_id' in frame.columns else frame
+            self.data_version = data_version
+            self.version += 1
+
+    # Save method writes the snapshot and its data version to a file, replacing it at once so that processes
+    # saving and loading the same file never see part of it.
+    def save(self, path: str) -> None:
+        """ Save the in-memory Animal collection to a file """
+        temporary = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+        with self.lock:
+            pd.to_pickle({'frame': self.frame, 'data_version': self.data_version}, temporary)
+        os.replace(temporary, path)
+
+    # Load method replaces the snapshot with one saved to a file.
+    def load(self, path: str) -> None:
+        """ Load the in-memory Animal collection from a file """
+        saved = pd.read_pickle(path)
+        with self.lock:
+            self.frame = saved['frame']
+            self.data_version = saved['data_version']
+            self.version += 1
+
+    # Catch up method reads back only documents written since the snapshot's data version.
+    def catch_up(self) -> None:
+        """ Bring the in-memory Animal collection up to date with MongoDB """
+        data_version = self.shelter.version()
+        if data_version == self.data_version:
+            return
+        animals = self.shelter.database.animals
+        changed = list(animals.find({'_version': {'$gt': self.data_version}}))
+        self._apply(changed, [], data_version)
+
+        # Deleted documents leave no trace, so reload when the number of animals no longer matches
+        if animals.count_documents({}) != len(self.frame):
+            self.reload()
+
+    # Select method to filter the snapshot with a MongoDB style query.
+    # Input -> key/value lookup pairs, supporting equality, $eq, $ne, $gt, $gte, $lt, $lte, $in, $regex and $and,
+    #          or an AnimalQuery, whose projection is also applied. Paging and sorting are left to page.
+    # Return -> DataFrame of the matching animals.
+    def select(self, query) -> pd.DataFrame:
+        """ Query a result from the in-memory Animal collection """
+        fields = None
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            fields = [field for field in query.fields if field != '_id'] or None
+            query = query.to_filter()
+        if query is not None and type(query) is dict:                    # query should be dictionary
+            frame = self.frame                                           # use one snapshot for the whole query
+            matches = frame[self._mask(frame, query)]
+            return matches[[field for field in fields if field in frame.columns]] if fields else matches
+        else:
+            raise Exception("Select error: invalid query parameter")     # Raise exception with improper input
+
+    # Locate method to find the animals matching a query without copying them.
+    # Input -> query accepted by select, whose projection is left to the caller.
+    # Return -> (snapshot the query ran on, positions of the matching rows in it, None when every row matches).
+    def locate(self, query) -> tuple:
+        """ Find the animals matching a query in the in-memory Animal collection """
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            query = query.to_filter()
+        if query is not None and type(query) is dict:                    # query should be dictionary
+            frame = self.frame                                           # use one snapshot for the whole query
+            mask = self._mask(frame, query)
+            return frame, None if mask.all() else np.flatnonzero(mask)
+        else:
+            raise Exception("Select error: invalid query parameter")     # Raise exception with improper input
+
+    # Page method to sort and slice selected animals the same way AnimalShelter.read does.
+    # Input -> DataFrame from select, paging (skip/limit) and a list of (field, direction) pairs to sort by.
+    # Return -> DataFrame of the requested page.
+    @staticmethod
+    def page(frame: pd.DataFrame, skip: int = 0, limit: int = 0, sort: list = None) -> pd.DataFrame:
+        """ Sort and page a selection from the in-memory Animal collection """
+        if sort and not frame.empty:
+            frame = frame.sort_values(by=[field for field, direction in sort],
+                                      ascending=[direction > 0 for field, direction in sort],
+                                      kind='mergesort')                  # stable sort, like MongoDB
+        return frame.iloc[skip: skip + limit] if limit else frame.iloc[skip:]
+
+    # Value count method to count selected animals with each value of a field, like AnimalShelter.value_counts,
+    # counting the animals missing the field as the value None.
+    # Input -> DataFrame from select or page, and the field to count the values of.
+    # Return -> list of (value, count) pairs, most frequent first, then None first and in value order like MongoDB.
+    @staticmethod
+    def value_counts(frame: pd.DataFrame, field: str) -> list:
+        """ Count the values of a field in a selection from the in-memory Animal collection """
+        if field not in frame.columns:
+            return [(None, len(frame))] if len(frame) else []
+        counts = frame[field].value_counts(sort=False, dropna=False)
+        counts = counts[counts > 0]                                      # skip categories with no matches
+        values = [None if pd.isna(value) else value for value in counts.index]
+        order = np.lexsort(([str(value) for value in values], [value is not None for value in values],
+                            -counts.to_numpy()))
+        return [(values[index], int(counts.iat[index])) for index in order]
+
+    # Stop following changes to the collection, saving the snapshot if it changed
+    def stop(self) -> None:
+        """ Stop the background thread that keeps the snapshot current """
+        self.stopped.set()
+        self._save_snapshot(force=True)
+
+    # Build a boolean mask of the rows matching a query
+    def _mask(self, frame: pd.DataFrame, query: dict) -> np.ndarray:
+        mask = np.ones(len(frame), dtype=bool)
+        for field, condition in query.items():
+            if field == '$and':
+                for part in condition:
+                    mask &= self._mask(frame, part)
+            elif field not in frame.columns:
+                mask &= self._compare(pd.Series(None, index=frame.index, dtype=object), condition)
+            else:
+                mask &= self._compare(frame[field], condition)
+        return mask
+
+    # Compare one column against a query condition
+    def _compare(self, column: pd.Series, condition) -> np.ndarray:
+        if type(condition) is not dict:
+            condition = {'$eq': condition}
+
+        mask = np.ones(len(column), dtype=bool)
+        for operator, value in condition.items():
+            if operator == '$eq':
+                mask &= self._equals(column, value)
+            elif operator == '$ne':
+                mask &= ~self._equals(column, value)
+            elif operator == '$in':
+                mask &= column.isin(value).to_numpy()
+            elif operator in ('$gt', '$gte', '$lt', '$lte'):
+                if type(value) in (int, float):
+                    values = pd.to_numeric(column, errors='coerce').to_numpy()
+                else:
+                    values = column.to_numpy(dtype=object)
+                    text = self._is_text(values)
+                    mask &= text                                         # like MongoDB, only text compares to text
+                    values = np.where(text, values, value)
+                if operator == '$gt':
+                    mask &= values > value
+                elif operator == '$gte':
+                    mask &= values >= value
+                elif operator == '$lt':
+                    mask &= values < value
+                else:
+                    mask &= values <= value
+            elif operator == '$regex':
+                flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+                mask &= self._search(column, re.compile(value, flags))
+            elif operator == '$options':
+                continue                                                 # used together with $regex
+            else:
+                raise Exception("Select error: unsupported query operator " + operator)
+        return mask
+
+    # Compare a column to a single value, using the category codes when possible. None matches missing values.
+    @staticmethod
+    def _equals(column: pd.Series, value) -> np.ndarray:
+        if value is None:
+            return column.isna().to_numpy()
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            categories = column.cat.categories
+            if value not in categories:
+                return np.zeros(len(column), dtype=bool)
+            return column.cat.codes.to_numpy() == categories.get_loc(value)
+        return (column == value).to_numpy()
+
+    # Search a column with a regular expression, matching only text values like MongoDB, and each category once
+    @staticmethod
+    def _search(column: pd.Series, regex) -> np.ndarray:
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            categories = column.cat.categories.to_numpy(dtype=object)
+            matched = np.append(AnimalCache._search(pd.Series(categories, dtype=object), regex), False)
+            return matched[column.cat.codes.to_numpy()]                  # code -1, a missing value, never matches
+        values = column.to_numpy(dtype=object)
+        return np.fromiter((type(value) is str and regex.search(value) is not None for value in values),
+                           dtype=bool, count=len(values))
+
+    # Flags of the values that are text, the only values MongoDB compares to text
+    @staticmethod
+    def _is_text(values: np.ndarray) -> np.ndarray:
+        return np.fromiter((type(value) is str for value in values), dtype=bool, count=len(values))
+
+    # Store text columns with few distinct values as categories
+    def _categorize(self, frame: pd.DataFrame) -> pd.DataFrame:
+        for column in self.category_columns:
+            if column in frame.columns:
+                frame[column] = frame[column].astype('category')                 # missing values stay NaN
+        return frame
+
+    # Apply inserted, changed and removed documents to the snapshot
+    def _apply(self, upserts: list, deletes: list, data_version: int = None) -> None:
+        with self.lock:
+            frame = self.frame.drop(index=[d['_id'] for d in upserts] + deletes, errors='ignore')
+            if upserts:
+                changed = pd.DataFrame.from_records(upserts).set_index('_id').drop(columns=['_version'],
+                                                                                  errors='ignore')
+                frame = pd.concat([frame.astype({c: object for c in self.category_columns if c in frame.columns}),
+                                   changed])
+            self.frame = self._categorize(frame)
+            self.data_version = data_version if data_version is not None else self.shelter.version()
+            self.version += 1
+
+    # Save the snapshot to the snapshot file if it changed since it was last saved, at most every save_interval
+    # seconds unless forced
+    def _save_snapshot(self, force: bool = False) -> None:
+        if not self.snapshot or self.version == self.saved_version:
+            return
+        if not force and time.monotonic() - self.saved_time < self.save_interval:
+            return
+        version = self.version
+        self.save(self.snapshot)
+        self.saved_version, self.saved_time = version, time.monotonic()
+
+    # Keep the snapshot current using a change stream, falling back to polling the data version
+    def _follow(self) -> None:
+        try:
+            self._follow_changes()
+        except Exception:
+            self._follow_versions()
+
+    # Apply change stream events in batches
+    def _follow_changes(self) -> None:
+        with self.shelter.watch() as stream:
+            while not self.stopped.is_set():
+                upserts, deletes = [], []
+                change = stream.try_next()
+                while change is not None:
+                    operation = change['operationType']
+                    if operation in ('insert', 'update', 'replace') and change.get('fullDocument'):
+                        upserts.append(change['fullDocument'])
+                    elif operation == 'delete':
+                        deletes.append(change['documentKey']['_id'])
+                    elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                        self.reload()
+                        upserts, deletes = [], []
+                    change = stream.try_next()
+                if upserts or deletes:
+                    self._apply(upserts, deletes)
+                else:
+                    time.sleep(0.1)                                      # try_next does not block between batches
+                self._save_snapshot()
+
+    # Poll the data version and read back only documents written since the last poll
+    def _follow_versions(self) -> None:
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.catch_up()
+                self._save_snapshot()
+            except Exception as e:                                       # keep polling if the database is unavailable
+                print("An exception occurred ::", e)
@@ -1,34 +1,322 @@
 # Python module that implements CRUD operations in MongoDB.
 
+import csv
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+import bson
+import pandas as pd
+
+from pandas.api.types import union_categoricals
 from pymongo import cursor
+from pymongo import ASCENDING
+from pymongo import InsertOne
 from pymongo import MongoClient
+from pymongo import ReplaceOne
+from pymongo import ReturnDocument
+from pymongo import monitoring
+from pymongo.errors import BulkWriteError
+from bson import json_util
 from bson.json_util import dumps
 
 
+# Decorator reporting the time taken by an AnimalShelter method, and the number of rows it returned when the result
+# is a list or DataFrame, to the functions registered with add_observer. Methods returning a cursor are timed
+# until the cursor is created, the documents are read when the cursor is used.
+def observed(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.observers:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        result = method(self, *args, **kwargs)
+        seconds = time.perf_counter() - start
+        rows = len(result) if isinstance(result, (list, pd.DataFrame)) else None
+        for observer in self.observers:
+            try:
+                observer(method.__name__, seconds, rows, args)
+            except Exception as e:
+                print("An exception occurred ::", e)
+        return result
+    return wrapper
+
+
+class AnimalQuery(object):
+    """ Composable query for the Animal collection """
+
+    # Initialize an AnimalQuery that matches every animal
+    def __init__(self) -> None:
+        self.conditions = {}                  # field -> value or operator dictionary
+        self.extra_conditions = []            # raw MongoDB queries combined with $and
+        self.fields = []                      # fields to return, empty returns every field
+        self.sort_fields = []                 # list of (field, direction) pairs
+        self.skip_count = 0
+        self.limit_count = 0                  # 0 returns every match
+        self.batch = 0                        # 0 uses the server default batch size
+        self.index_hint = None
+
+    # Match animals whose field equals a value; empty values (None or "") are ignored
+    def where(self, field: str, value) -> 'AnimalQuery':
+        if value is not None and value != '':
+            self.conditions[field] = value
+        return self
+
+    # Match animals whose field is within an inclusive range; a missing bound leaves that side open
+    def between(self, field: str, low=None, high=None) -> 'AnimalQuery':
+        condition = {}
+        if low is not None:
+            condition['$gte'] = low
+        if high is not None:
+            condition['$lte'] = high
+        if condition:
+            self.conditions[field] = condition
+        return self
+
+    # Match animals with an additional MongoDB query
+    def match(self, query: dict) -> 'AnimalQuery':
+        if query:
+            self.extra_conditions.append(query)
+        return self
+
+    # Return only the given fields
+    def project(self, *fields: str) -> 'AnimalQuery':
+        self.fields = list(fields)
+        return self
+
+    # Sort by a list of (field, direction) pairs
+    def sort(self, fields: list) -> 'AnimalQuery':
+        self.sort_fields = list(fields or [])
+        return self
+
+    # Skip the first matches
+    def skip(self, count: int) -> 'AnimalQuery':
+        self.skip_count = count
+        return self
+
+    # Return at most count matches
+    def limit(self, count: int) -> 'AnimalQuery':
+        self.limit_count = count
+        return self
+
+    # Number of documents MongoDB returns per batch
+    def batch_size(self, count: int) -> 'AnimalQuery':
+        self.batch = count
+        return self
+
+    # Index MongoDB should use, by name or as a list of (field, direction) pairs
+    def hint(self, index) -> 'AnimalQuery':
+        self.index_hint = index
+        return self
+
+    # MongoDB query document
+    def to_filter(self) -> dict:
+        if self.extra_conditions:
+            return {'$and': [self.conditions] + self.extra_conditions}
+        return dict(self.conditions)
+
+    # MongoDB projection document
+    def to_projection(self) -> dict:
+        if self.fields:                                                  # MongoDB cannot project empty field names
+            return dict({field: 1 for field in self.fields if field}, _id=1 if '_id' in self.fields else 0)
+        return dict(AnimalShelter.internal_fields)
+
+    # Key that identifies the query, equal for queries that return the same results
+    def key(self) -> str:
+        return json.dumps([self.to_filter(), self.to_projection(), self.sort_fields,
+                           self.skip_count, self.limit_count], sort_keys=True, default=str)
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """ Connection pool counters of one MongoClient """
+
+    # Initialize PoolStats with every counter at zero
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counts = {'created': 0, 'closed': 0, 'checked_out': 0, 'checked_in': 0,
+                       'checkout_failed': 0, 'cleared': 0}
+
+    # Counters and the number of connections currently open and in use
+    def snapshot(self) -> dict:
+        with self.lock:
+            stats = dict(self.counts)
+        stats['open'] = stats['created'] - stats['closed']
+        stats['in_use'] = stats['checked_out'] - stats['checked_in']
+        return stats
+
+    # Increase one counter
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] += 1
+
+    # Pool events reported by the driver
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.count('cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.count('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.count('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.count('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self.count('checked_out')
+
+    def connection_checked_in(self, event):
+        self.count('checked_in')
+
+
+# Read the connection settings from environment variables.
+# Return -> dictionary with the uri, username, password and database name, and the MongoClient pool, timeout and
+#           read preference options; unset variables use the defaults below.
+def connection_settings(environ=os.environ) -> dict:
+    def number(name, default):
+        return int(environ.get(name, default))
+    return {'uri': environ.get('AAC_MONGO_URI', 'mongodb://localhost:27017'),
+            'username': environ.get('AAC_MONGO_USER'),
+            'password': environ.get('AAC_MONGO_PASSWORD'),
+            'database': environ.get('AAC_MONGO_DATABASE', 'AAC'),
+            'options': {'maxPoolSize': number('AAC_MONGO_MAX_POOL_SIZE', 20),
+                        'minPoolSize': number('AAC_MONGO_MIN_POOL_SIZE', 0),
+                        'maxIdleTimeMS': number('AAC_MONGO_MAX_IDLE_TIME_MS', 60000),
+                        'waitQueueTimeoutMS': number('AAC_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+                        'connectTimeoutMS': number('AAC_MONGO_CONNECT_TIMEOUT_MS', 5000),
+                        'serverSelectionTimeoutMS': number('AAC_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+                        'socketTimeoutMS': number('AAC_MONGO_SOCKET_TIMEOUT_MS', 30000),
+                        'readPreference': environ.get('AAC_MONGO_READ_PREFERENCE', 'primaryPreferred')}}
+
+
 class AnimalShelter(object):
     """ CRUD operations for Animal collection in MongoDB """
 
+    # Fields maintained by this class that are not part of the animal data
+    internal_fields = {'_id': 0, '_version': 0}
+
+    # Fields the dashboard filters on by equality, and the field it filters on by range
+    equality_fields = ['animal_type', 'breed', 'sex_upon_outcome']
+    range_field = 'age_upon_outcome_in_weeks'
+
+    # Decoded documents take about this many times their BSON size in memory
+    decoded_size_factor = 8
+
+    # Fields converted to numbers when importing text files
+    numeric_fields = ['location_lat', 'location_long', 'age_upon_outcome_in_weeks']
+
+    # Compound indexes covering every dashboard query shape: one index for each combination of selected menus,
+    # holding exactly those equality fields followed by the age range, so the range is always scanned with tight
+    # bounds instead of across the keys of an unselected menu.
+    indexes = [
+        [('animal_type', ASCENDING), ('breed', ASCENDING), ('sex_upon_outcome', ASCENDING), (range_field, ASCENDING)],
+        [('animal_type', ASCENDING), ('breed', ASCENDING), (range_field, ASCENDING)],
+        [('animal_type', ASCENDING), ('sex_upon_outcome', ASCENDING), (range_field, ASCENDING)],
+        [('breed', ASCENDING), ('sex_upon_outcome', ASCENDING), (range_field, ASCENDING)],
+        [('animal_type', ASCENDING), (range_field, ASCENDING)],
+        [('breed', ASCENDING), (range_field, ASCENDING)],
+        [('sex_upon_outcome', ASCENDING), (range_field, ASCENDING)],
+        [(range_field, ASCENDING)],
+        [('_version', ASCENDING)],                                       # documents changed since a data version
+        [('datetime', ASCENDING)],                                       # months recounted by outcome_rollups
+    ]
+
+    # Clients shared by every AnimalShelter with the same settings in a process, with their pool counters
+    clients = {}
+    clients_lock = threading.Lock()
+
     # Initialize AnimalShelter object
-    def __init__(self, userval: str, passval: str) -> None:
-        # Initializing the MongoClient. This helps to
-        # access the MongoDB databases and collections.
-        # Note, the authentication code provided to students does not work:
-        # self.client = MongoClient('mongodb://%s:%s@localhost:27017' % (userval, passval))
-        # Instead, use the following to authenticate:
-        self.client = MongoClient('mongodb://localhost:27017', username=userval, password=passval)
-        # Use the AAC database
-        self.database = self.client['AAC']
+    # The username, password and connection settings default to the AAC_MONGO_* environment variables.
+    # An existing client (e.g. a mongomock.MongoClient for local testing) can be passed in instead of connecting.
+    def __init__(self, userval: str = None, passval: str = None, client: MongoClient = None,
+                 settings: dict = None) -> None:
+        self.settings = settings or connection_settings()
+        if userval is not None:
+            self.settings = dict(self.settings, username=userval, password=passval)
+        # Initializing the MongoClient is deferred to the first query, so a server process can fork workers first
+        self.own_client = client
+        # Functions called with the operation name and its input after every successful write
+        self.listeners = []
+        # Functions called with the method name, seconds taken, rows returned and arguments after every method call
+        self.observers = []
+
+    # MongoClient shared by this process. A new client is created in each forked worker process, because
+    # a client's sockets and monitoring threads must not be shared across a fork.
+    @property
+    def client(self) -> MongoClient:
+        if self.own_client is not None:
+            return self.own_client
+        return self._shared_client()[0]
+
+    # Use the AAC database
+    @property
+    def database(self):
+        return self.client[self.settings['database']]
+
+    # Shared client method used by tests and benchmarks to run code that creates its own AnimalShelter
+    # against a stand-in database.
+    # Input -> client (e.g. a mongomock.MongoClient) used by every AnimalShelter created in this process with
+    #          the given settings, by default those from the environment variables.
+    @classmethod
+    def use_client(cls, client: MongoClient, settings: dict = None) -> None:
+        """ Share an existing client with every AnimalShelter using the same settings """
+        key = cls(settings=settings)._client_key()
+        with cls.clients_lock:
+            cls.clients[key] = (client, PoolStats())
+
+    # Health method used by load balancers and monitoring.
+    # Return -> dictionary with whether the server answered a ping, the ping time in ms, the process id
+    #           and the connection pool counters.
+    def health(self) -> dict:
+        """ Check the connection to the AAC database """
+        start = time.perf_counter()
+        try:
+            self.client.admin.command('ping')
+            status = {'ok': True, 'ping_ms': round((time.perf_counter() - start) * 1000, 2)}
+        except Exception as e:
+            status = {'ok': False, 'error': str(e)}
+        status.update(pid=os.getpid(), pool=self.pool_stats())
+        return status
+
+    # Pool statistics method.
+    # Return -> connection pool counters of this process's client, empty for a client passed in.
+    def pool_stats(self) -> dict:
+        """ Get the connection pool counters of the AAC database client """
+        if self.own_client is not None:
+            return {}
+        return self._shared_client()[1].snapshot()
 
     # Complete this create method to implement the C in CRUD.
     # Input -> key/value pairs in the data type acceptable to the MongoDB driver insert API call.
     # Return -> “True” if successful insert, else “False.”
     # Note in order to return False, an except block is needed to catch exceptions and return false,
     # otherwise the program will end without returning.
+    @observed
     def create(self, data: dict) -> bool:
         """ Insert a document into the AAC database """
         if data is not None and type(data) is dict:   # data should be dictionary
             try:
-                self.database.animals.insert(data)                       # call insert method
+                data = dict(data, _version=self._next_version())         # stamp the document with the data version
+                self.database.animals.insert_one(data)                   # call insert_one method
+                self._notify('create', data)                             # let listeners update derived data
                 return True                                              # if successful, return true
             except Exception as e:                                       # catch exceptions
                 print("An exception occurred ::", e)                     # print exception
@@ -36,23 +324,180 @@ class AnimalShelter(object):
         else:
             raise Exception("Nothing to save, because data parameter is empty")   # Raise exception with improper input
 
+    # Bulk create method to insert many documents with few round trips.
+    # Input -> iterable of documents, read lazily, and the number of documents written per bulk_write call.
+    # Return -> dictionary with the total number of documents inserted and a report for every batch.
+    #           Batches are unordered, so a failed document (e.g. a duplicate key) does not stop the others.
+    @observed
+    def create_many(self, documents, batch_size: int = 1000) -> dict:
+        """ Insert many documents into the AAC database """
+        return self._bulk_write(documents, batch_size, lambda document: InsertOne(document))
+
+    # Bulk upsert method to insert new documents and replace existing ones with few round trips.
+    # Input -> iterable of documents, the fields identifying an existing document, and the number of documents
+    #          written per bulk_write call.
+    # Return -> dictionary with the total number of documents inserted, upserted and modified, and a report
+    #           for every batch.
+    @observed
+    def upsert_many(self, documents, key_fields: list = ('animal_id', 'datetime'), batch_size: int = 1000) -> dict:
+        """ Insert or replace many documents in the AAC database """
+        return self._bulk_write(documents, batch_size,
+                                lambda document: ReplaceOne({field: document.get(field) for field in key_fields},
+                                                            document, upsert=True))
+
+    # Import method to load a shelter outcomes export, streaming it in batches.
+    # Input -> path of a CSV file with a header row, or of a JSON file (.json, .ndjson, .jsonl) holding an array of
+    #          documents or one document per line, optional fields identifying existing documents to replace instead
+    #          of inserting duplicates, and the number of documents written per bulk_write call.
+    # Return -> dictionary with the totals and a report for every batch, like create_many and upsert_many.
+    @observed
+    def import_file(self, path: str, key_fields: list = None, batch_size: int = 1000) -> dict:
+        """ Import a CSV or JSON file into the AAC database """
+        with open(path, newline='', encoding='utf-8') as file:
+            if path.lower().endswith(('.ndjson', '.jsonl', '.json')):
+                documents = self._json_documents(file)
+            else:
+                documents = (self._convert_row(row) for row in csv.DictReader(file))
+            if key_fields:
+                return self.upsert_many(documents, key_fields, batch_size)
+            return self.create_many(documents, batch_size)
+
     # Create method to implement the R in CRUD.
-    # Input -> key/value lookup pair to use with the MongoDB driver find API call.
+    # Input -> key/value lookup pair to use with the MongoDB driver find API call, plus optional
+    #          paging (skip/limit) and a list of (field, direction) pairs to sort by,
+    #          or an AnimalQuery, which also sets the projection, batch size and index hint.
     # Return -> result in cursor if successful, else MongoDB returned error message.
-    def read(self, query: dict) -> cursor.Cursor:
+    @observed
+    def read(self, query, skip: int = 0, limit: int = 0, sort: list = None) -> cursor.Cursor:
         """ Query a result from the AAC database """
-        if query is not None and type(query) is dict:                    # data should be dictionary
-            return self.database.animals.find(query, {'_id': 0})         # call find method and return results, omit id
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            results = self.database.animals.find(query.to_filter(), query.to_projection())
+            if query.batch:
+                results = results.batch_size(query.batch)                # documents per round trip
+            if query.index_hint:
+                results = results.hint(query.index_hint)                 # force the index to use
+            skip, limit, sort = query.skip_count, query.limit_count, query.sort_fields
+        elif query is not None and type(query) is dict:                  # data should be dictionary
+            results = self.database.animals.find(query, self.internal_fields)  # call find method, omit id and version
         else:
             raise Exception("Read error: invalid query parameter")       # Raise exception with improper input
+        if sort:
+            results = results.sort(sort)                                 # sort on the server before paging
+        return results.skip(skip).limit(limit)                           # limit of 0 returns all results
+
+    # Batch read method to convert large results to DataFrames without holding every document at once.
+    # Input -> key/value lookup pair or AnimalQuery, an optional projection for a lookup pair, fields to store as
+    #          categories, and the memory in bytes the decoded documents of one batch may use.
+    # Return -> generator of DataFrames, one per batch of raw BSON documents, with one column per field.
+    def read_frames(self, query, projection: dict = None, categories: list = (), memory_limit: int = 32 * 1024 ** 2):
+        """ Query results from the AAC database as DataFrames, one batch at a time """
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            query, projection = query.to_filter(), query.to_projection()
+        elif query is None or type(query) is not dict:
+            raise Exception("Read error: invalid query parameter")       # Raise exception with improper input
+        projection = projection if projection is not None else self.internal_fields
+
+        # Size the batches from the first document; decoded Python objects take several times their BSON size
+        first = self.database.animals.find_one(query, projection)
+        if first is None:
+            return
+        batch_size = max(int(memory_limit // (len(bson.encode(first)) * self.decoded_size_factor)), 1)
+
+        # Decode each raw batch into columns, so documents are only held for one batch at a time
+        for documents in self._raw_batches(query, projection, batch_size):
+            fields = list(dict.fromkeys(field for document in documents for field in document))
+            frame = pd.DataFrame({field: [document.get(field) for document in documents] for field in fields})
+            for field in categories:
+                if field in frame.columns:
+                    frame[field] = frame[field].astype('category')               # missing values stay NaN
+            yield frame
+
+    # Frame read method to convert a large result to one DataFrame, one batch at a time.
+    # Input -> same as read_frames; categorical columns keep small category codes while batches are combined.
+    # Return -> DataFrame of the matching documents.
+    @observed
+    def read_frame(self, query, projection: dict = None, categories: list = (),
+                   memory_limit: int = 32 * 1024 ** 2) -> pd.DataFrame:
+        """ Query a result from the AAC database as a DataFrame """
+        frames = list(self.read_frames(query, projection, categories, memory_limit))
+        if not frames:                                                   # keep the projected columns of no matches
+            if isinstance(query, AnimalQuery):
+                projection = query.to_projection()
+            return pd.DataFrame(columns=[field for field, shown in (projection or {}).items() if shown])
+        columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+        combined = {}
+        for column in columns:
+            parts = [frame[column] if column in frame.columns else pd.Series([None] * len(frame), dtype=object)
+                     for frame in frames]
+            if column in categories:
+                parts = [part if isinstance(part.dtype, pd.CategoricalDtype) else part.astype('category')
+                         for part in parts]
+                # Batches can have numeric categories in one and text in another, which only unite as objects
+                parts = [pd.Categorical.from_codes(part.cat.codes, pd.Index(part.cat.categories, dtype=object))
+                         for part in parts]
+                combined[column] = pd.Series(union_categoricals(parts))
+            else:
+                combined[column] = pd.concat(parts, ignore_index=True)
+        return pd.DataFrame(combined)
+
+    # Count method used to size paged results.
+    # Input -> key/value lookup pair or AnimalQuery to use with the MongoDB driver count_documents API call.
+    # Return -> number of documents matching the query, ignoring any paging.
+    @observed
+    def count(self, query) -> int:
+        """ Count the documents matching a query in the AAC database """
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            query = query.to_filter()
+        if query is not None and type(query) is dict:                    # data should be dictionary
+            return self.database.animals.count_documents(query)          # call count_documents method
+        else:
+            raise Exception("Count error: invalid query parameter")      # Raise exception with improper input
+
+    # Aggregate method used to summarize the animals collection on the server.
+    # Input -> list of aggregation pipeline stages to use with the MongoDB driver aggregate API call.
+    # Return -> result in cursor if successful, else MongoDB returned error message.
+    @observed
+    def aggregate(self, pipeline: list) -> cursor.Cursor:
+        """ Aggregate results from the AAC database """
+        if pipeline is not None and type(pipeline) is list:              # pipeline should be list
+            return self.database.animals.aggregate(pipeline)             # call aggregate method and return results
+        else:
+            raise Exception("Aggregate error: invalid pipeline parameter")  # Raise exception with improper input
+
+    # Value count method used to chart the animals matching a query without reading them.
+    # Input -> key/value lookup pair or AnimalQuery, and the field to count the values of.
+    # Return -> list of (value, count) pairs, most frequent first.
+    @observed
+    def value_counts(self, query, field: str) -> list:
+        """ Count the animals with each value of a field in the AAC database """
+        pipeline = self.count_pipeline(query, field)
+        return [(group['_id'], group['count']) for group in self.aggregate(pipeline)]
+
+    # Pipeline counting the animals with each value of a field, used by value_counts.
+    # Input -> key/value lookup pair or AnimalQuery, and the field to count the values of.
+    # Return -> list of aggregation pipeline stages.
+    @staticmethod
+    def count_pipeline(query, field: str) -> list:
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            query = query.to_filter()
+        if query is not None and type(query) is dict:                    # data should be dictionary
+            return [{'$match': query},
+                    {'$group': {'_id': '$' + field, 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1, '_id': 1}}]
+        else:
+            raise Exception("Count error: invalid query parameter")      # Raise exception with improper input
 
     # Update method to implement the U in CRUD.
     # Input -> key/value lookup pair to find and key/value pairs to insert.
     # Return -> result in JSON format if successful, else MongoDB returned error message.
+    @observed
     def update(self, query: dict, changes: dict) -> str:
         """ Update a document in the AAC database """
         if (query is not None and type(query) is dict) and (changes is not None and type(changes) is dict):
+            changes = dict(changes)                                      # stamp changed documents with the data version
+            changes['$set'] = dict(changes.get('$set', {}), _version=self._next_version())
             updated = self.database.animals.update_many(query, changes)  # call update_many method
+            self._notify('update', query)                                # let listeners update derived data
             return dumps(updated.raw_result)                             # return raw_result in JSON format
         else:
             raise Exception("Update error: invalid update parameters")   # Raise exception with improper input
@@ -60,10 +505,274 @@ class AnimalShelter(object):
     # Delete method to implement the D in CRUD.
     # Input -> key/value lookup pair to delete
     # Return -> result in JSON format if successful, else MongoDB returned error message.
+    @observed
     def delete(self, remove: dict) -> str:
         """ Delete a document from the AAC database """
         if remove is not None and type(remove) is dict:                  # data should be dictionary
             deleted = self.database.animals.delete_many(remove)          # call delete_many method
+            self._next_version()                                         # let readers know documents were removed
+            self._notify('delete', remove)                               # let listeners update derived data
             return dumps(deleted.raw_result)                             # return raw_result in JSON format
         else:
             raise Exception("Delete error: invalid delete parameter")    # Raise exception with improper input
+
+    # Index method to create the indexes used by the dashboard; indexes that already exist are left as they are.
+    # Return -> names of the indexes.
+    @observed
+    def ensure_indexes(self) -> list:
+        """ Create the indexes for the dashboard queries on the Animal collection """
+        return [self.database.animals.create_index(keys) for keys in self.indexes]
+
+    # Explain method used to check how MongoDB runs a query.
+    # Input -> key/value lookup pair or AnimalQuery to explain.
+    # Return -> dictionary with the plan stage (e.g. IXSCAN or COLLSCAN), the index used, whether its bounds are
+    #           tight (single values for every field before the age range, and a bounded age range), the number of
+    #           keys and documents examined, the number of documents returned and the execution time in ms.
+    @observed
+    def explain(self, query) -> dict:
+        """ Explain how a query runs on the AAC database """
+        plan = self.read(query).explain()
+        stats = plan.get('executionStats', {})
+        stages = list(self._plan_stages(plan.get('queryPlanner', {}).get('winningPlan', {})))
+        return {'query': query.to_filter() if isinstance(query, AnimalQuery) else query,
+                'stage': 'COLLSCAN' if any(stage == 'COLLSCAN' for stage, index in stages)
+                else 'IXSCAN' if any(index for stage, index in stages)
+                else stages[0][0] if stages else None,
+                'index': next((index for stage, index in stages if index), None),
+                'tight': self._tight_bounds(plan.get('queryPlanner', {}).get('winningPlan', {})),
+                'keys_examined': stats.get('totalKeysExamined'),
+                'docs_examined': stats.get('totalDocsExamined'),
+                'returned': stats.get('nReturned'),
+                'ms': stats.get('executionTimeMillis')}
+
+    # Explain method for every combination of dashboard menus with an age range, checking each uses an index
+    # with tight bounds.
+    # Input -> optional example document supplying the menu values, otherwise the first animal found.
+    # Return -> list of explain reports, one per query shape.
+    def explain_shapes(self, example: dict = None) -> list:
+        """ Explain every dashboard query shape on the AAC database """
+        example = example or self.database.animals.find_one({}, self.internal_fields) or {}
+        reports = []
+        for count in range(len(self.equality_fields) + 1):
+            for fields in itertools.combinations(self.equality_fields, count):
+                query = AnimalQuery().between(self.range_field, 0, (example.get(self.range_field) or 0) + 1)
+                for field in fields:
+                    query.where(field, example.get(field))
+                reports.append(self.explain(query))
+        loose = [report['query'] for report in reports if report['stage'] != 'IXSCAN' or not report['tight']]
+        if loose:
+            raise Exception("Explain error: no index with tight bounds for " + dumps(loose))
+        return reports
+
+    # Version method used by readers that keep a copy of the animals collection.
+    # Return -> number of writes made through this class, increased by every create, update and delete.
+    @observed
+    def version(self) -> int:
+        """ Get the current data version of the Animal collection """
+        found = self.database.versions.find_one({'_id': 'animals'})
+        return found['version'] if found else 0
+
+    # Watch method used by readers that keep a copy of the animals collection.
+    # Return -> change stream of the animals collection with the full document for inserts and updates.
+    # Note, change streams need a replica set; a standalone server raises an exception instead.
+    def watch(self):
+        """ Open a change stream on the Animal collection """
+        return self.database.animals.watch(full_document='updateLookup')
+
+    # Listener method used to keep derived data current.
+    # Input -> function called as listener(operation, data) after every create, update and delete, where data is
+    #          the inserted document or the query that selected the changed documents.
+    def add_listener(self, listener) -> None:
+        """ Register a function to call after writes to the Animal collection """
+        self.listeners.append(listener)
+
+    # Observer method used to measure the database access.
+    # Input -> function called as observer(method, seconds, rows, args) after every CRUD, read, count, aggregate,
+    #          index and version method call, where rows is None unless the method returned a list or DataFrame.
+    def add_observer(self, observer) -> None:
+        """ Register a function to call with the time taken by each AnimalShelter method """
+        self.observers.append(observer)
+
+    # Call every listener, reporting but not raising their exceptions so the write still succeeds
+    def _notify(self, operation: str, data: dict) -> None:
+        for listener in self.listeners:
+            try:
+                listener(operation, data)
+            except Exception as e:
+                print("An exception occurred ::", e)
+
+    # Forget the clients of the parent process in a forked worker, including a lock a parent thread may hold
+    @classmethod
+    def _after_fork(cls) -> None:
+        cls.clients = {}
+        cls.clients_lock = threading.Lock()
+
+    # Key of the client for this process and these settings
+    def _client_key(self) -> tuple:
+        settings = self.settings
+        return (os.getpid(), settings['uri'], settings['username'], settings['password'], settings['database'],
+                tuple(sorted(settings['options'].items())))
+
+    # Get or create the client for this process and these settings
+    def _shared_client(self) -> tuple:
+        settings = self.settings
+        key = self._client_key()
+        with self.clients_lock:
+            if key not in self.clients:
+                stats = PoolStats()
+                client = MongoClient(settings['uri'],
+                                     username=settings['username'],
+                                     password=settings['password'],
+                                     connect=False,                      # connect on first use
+                                     event_listeners=[stats],
+                                     **settings['options'])
+                self.clients[key] = (client, stats)
+            return self.clients[key]
+
+    # Read documents in raw BSON batches of batch_size, decoding one batch at a time
+    def _raw_batches(self, query: dict, projection: dict, batch_size: int):
+        animals = self.database.animals
+        try:
+            raw_batches = animals.find_raw_batches(query, projection, batch_size=batch_size)
+        except NotImplementedError:                                      # test stand-ins without raw batches
+            raw_batches = None
+        if raw_batches is not None:
+            for raw in raw_batches:
+                yield bson.decode_all(raw)
+        else:
+            results = animals.find(query, projection)
+            documents = list(itertools.islice(results, batch_size))
+            while documents:
+                yield documents
+                documents = list(itertools.islice(results, batch_size))
+
+    # Write documents in unordered batches, stamping each batch with a new data version
+    def _bulk_write(self, documents, batch_size: int, operation) -> dict:
+        summary = {'inserted': 0, 'upserted': 0, 'modified': 0, 'errors': 0, 'batches': []}
+        documents = iter(documents)
+        batch = list(itertools.islice(documents, batch_size))
+        while batch:
+            version = self._next_version()
+            batch = [dict(document, _version=version) for document in batch]
+            try:
+                result = self.database.animals.bulk_write([operation(document) for document in batch], ordered=False)
+                details, errors = result.bulk_api_result, []
+            except BulkWriteError as e:                                  # some documents failed, the rest are written
+                details = e.details
+                errors = [{'index': len(summary['batches']) * batch_size + error['index'],
+                           'code': error.get('code'),
+                           'message': error.get('errmsg')} for error in details.get('writeErrors', [])]
+
+            # Report the batch
+            report = {'batch': len(summary['batches']),
+                      'size': len(batch),
+                      'inserted': details.get('nInserted', 0),
+                      'upserted': details.get('nUpserted', 0),
+                      'modified': details.get('nModified', 0),
+                      'errors': errors}
+            summary['batches'].append(report)
+            for total in ('inserted', 'upserted', 'modified'):
+                summary[total] += report[total]
+            summary['errors'] += len(errors)
+
+            # Let listeners update derived data, inserts one document at a time and replacements as one update
+            failed = {error['index'] % batch_size for error in errors}
+            if details.get('nInserted', 0):
+                for index, document in enumerate(batch):
+                    if index not in failed:
+                        self._notify('create', document)
+            if details.get('nUpserted', 0) or details.get('nModified', 0):
+                self._notify('update', {'_version': version})
+
+            batch = list(itertools.islice(documents, batch_size))
+        return summary
+
+    # Documents of a JSON file with one document per line, or of a JSON array, decoded a chunk of the file at a time.
+    # MongoDB Extended JSON, as written by mongoexport, is decoded to ObjectIds, dates and the other BSON types.
+    @staticmethod
+    def _json_documents(file, chunk_size: int = 1024 ** 2):
+        first = file.read(1)
+        while first.isspace():
+            first = file.read(1)
+        if first != '[':
+            file.seek(0)
+            yield from (json_util.loads(line) for line in file if line.strip())
+            return
+
+        decoder = json.JSONDecoder(object_hook=json_util.object_hook)      # Extended JSON, e.g. {"$oid": ...}
+        buffer, position, ended = '', 0, False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':  # between documents
+                position += 1
+            if buffer.startswith(']', position):
+                return
+            try:
+                document, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if ended:
+                    raise                                                # not a complete JSON array
+                chunk = file.read(chunk_size)                            # the document continues in the next chunk
+                buffer, position, ended = buffer[position:] + chunk, 0, not chunk
+                continue
+            yield document
+
+    # Convert the numeric fields of a row read from a CSV file, leaving empty values as None
+    def _convert_row(self, row: dict) -> dict:
+        for field in self.numeric_fields:
+            if field in row:
+                try:
+                    row[field] = float(row[field]) if row[field] != '' else None
+                except ValueError:
+                    pass                                                 # keep values that are not numbers
+        return row
+
+    # Find the stage and index name of each step of a query plan
+    def _plan_stages(self, plan):
+        for node in self._plan_nodes(plan):
+            yield node['stage'], node.get('indexName')
+
+    # Whether every index scan of a plan has single values for the fields before the age range and a bounded
+    # age range, e.g. {"animal_type": ['["Dog", "Dog"]'], "age_upon_outcome_in_weeks": ['[0.0, 105.0]']}
+    def _tight_bounds(self, plan) -> bool:
+        scans = [stage for stage in self._plan_nodes(plan) if stage.get('stage') == 'IXSCAN']
+        for scan in scans:
+            for field, intervals in scan.get('indexBounds', {}).items():
+                for interval in intervals:
+                    if field == self.range_field:
+                        if any(word in interval for word in ('MinKey', 'MaxKey', 'inf')):
+                            return False
+                    elif not self._single_value(interval):
+                        return False
+        return bool(scans)
+
+    # Every stage of a query plan, nested input stages included
+    def _plan_nodes(self, plan):
+        if isinstance(plan, dict):
+            if 'stage' in plan:
+                yield plan
+            for value in plan.values():
+                yield from self._plan_nodes(value)
+        elif isinstance(plan, list):
+            for value in plan:
+                yield from self._plan_nodes(value)
+
+    # Whether an index bounds interval holds a single value, e.g. '["Dog", "Dog"]'
+    @staticmethod
+    def _single_value(interval: str) -> bool:
+        inner = interval[1:-1]
+        size = (len(inner) - 2) // 2
+        return (interval[:1] == '[' and interval[-1:] == ']' and len(inner) == 2 * size + 2 and
+                inner[size:size + 2] == ', ' and inner[:size] == inner[size + 2:])
+
+    # Increase the data version and return the new value
+    def _next_version(self) -> int:
+        found = self.database.versions.find_one_and_update({'_id': 'animals'},
+                                                           {'$inc': {'version': 1}},
+                                                           upsert=True,
+                                                           return_document=ReturnDocument.AFTER)
+        return found['version']
+
+
+# Give every forked worker process its own clients
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=AnimalShelter._after_fork)
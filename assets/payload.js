@@ -0,0 +1,52 @@
+// Decode the compact payloads made by payload.py in the browser, in clientside callbacks.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    payload: {
+
+        // Convert a payload from payload.encode_frame into a list of records for a DataTable
+        records: function (payload) {
+            if (!payload) {
+                return [];
+            }
+            var names = Object.keys(payload.columns);
+            var columns = names.map(function (name) {
+                var values = payload.columns[name];
+                if (values === null || Array.isArray(values)) {
+                    return values;
+                }
+                return values.codes.map(function (code) {    // dictionary encoded column
+                    return code >= 0 ? values.categories[code] : null;
+                });
+            });
+            var records = new Array(payload.length);
+            for (var row = 0; row < payload.length; row++) {
+                var record = {};
+                for (var i = 0; i < names.length; i++) {
+                    record[names[i]] = columns[i] === null ? null : columns[i][row];
+                }
+                records[row] = record;
+            }
+            return records;
+        },
+
+        // Convert a payload from map_layer.to_payload into a GeoJSON FeatureCollection of points,
+        // using the lat and lon columns as coordinates and the other columns as properties
+        geojson: function (payload) {
+            if (!payload) {
+                return null;
+            }
+            var records = window.dash_clientside.payload.records(payload);
+            return {
+                type: 'FeatureCollection',
+                features: records.map(function (record) {
+                    var properties = Object.assign({}, record);
+                    delete properties.lat;
+                    delete properties.lon;
+                    return {type: 'Feature',
+                            geometry: {type: 'Point', coordinates: [record.lon, record.lat]},
+                            properties: properties};
+                })
+            };
+        }
+    }
+});
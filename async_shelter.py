@@ -0,0 +1,148 @@
+# Python module that reads the animals collection in MongoDB with asyncio, so the queries of one request run at once.
+
+import asyncio
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from animal_shelter import AnimalShelter, AnimalQuery
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient  # optional asyncio MongoDB driver
+except ImportError:
+    AsyncIOMotorClient = None
+
+
+class AsyncAnimalShelter(object):
+    """ Asyncio counterpart of the AnimalShelter read methods """
+
+    # Initialize AsyncAnimalShelter object
+    # Input -> AnimalShelter whose connection settings are used, and the number of threads running its queries
+    #          when motor is not installed or the shelter uses a client passed in (e.g. a mongomock.MongoClient).
+    def __init__(self, shelter: AnimalShelter, max_workers: int = 8) -> None:
+        self.shelter = shelter
+        self.max_workers = max_workers
+        self.native = AsyncIOMotorClient is not None and shelter.own_client is None
+        self.lock = threading.Lock()
+        self.pid = None                       # process the event loop, threads and motor client belong to
+        self.loop = None
+        self.executor = None
+        self.motor_client = None
+
+    # Read method, like AnimalShelter.read.
+    # Input -> key/value lookup pair or AnimalQuery, and paging and sorting for a lookup pair.
+    # Return -> list of the matching documents.
+    async def read(self, query, skip: int = 0, limit: int = 0, sort: list = None) -> list:
+        """ Query a result from the AAC database """
+        if not self.native:
+            return await self._in_thread(lambda: list(self.shelter.read(query, skip, limit, sort)))
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            results = self._animals().find(query.to_filter(), query.to_projection())
+            if query.batch:
+                results = results.batch_size(query.batch)                # documents per round trip
+            if query.index_hint:
+                results = results.hint(query.index_hint)                 # force the index to use
+            skip, limit, sort = query.skip_count, query.limit_count, query.sort_fields
+        elif query is not None and type(query) is dict:                  # data should be dictionary
+            results = self._animals().find(query, AnimalShelter.internal_fields)  # omit id and version
+        else:
+            raise Exception("Read error: invalid query parameter")       # Raise exception with improper input
+        if sort:
+            results = results.sort(sort)                                 # sort on the server before paging
+        return await results.skip(skip).limit(limit).to_list(length=None)
+
+    # Frame read method, like AnimalShelter.read_frame. Raw BSON batches are only read by pymongo,
+    # so this always runs AnimalShelter.read_frame in a thread.
+    # Return -> DataFrame of the matching documents.
+    async def read_frame(self, query, projection: dict = None, categories: list = ()) -> pd.DataFrame:
+        """ Query a result from the AAC database as a DataFrame """
+        return await self._in_thread(lambda: self.shelter.read_frame(query, projection, categories))
+
+    # Count method, like AnimalShelter.count.
+    # Return -> number of documents matching the query, ignoring any paging.
+    async def count(self, query) -> int:
+        """ Count the documents matching a query in the AAC database """
+        if not self.native:
+            return await self._in_thread(lambda: self.shelter.count(query))
+        if isinstance(query, AnimalQuery):                               # query built with AnimalQuery
+            query = query.to_filter()
+        if query is not None and type(query) is dict:                    # data should be dictionary
+            return await self._animals().count_documents(query)
+        else:
+            raise Exception("Count error: invalid query parameter")      # Raise exception with improper input
+
+    # Aggregate method, like AnimalShelter.aggregate.
+    # Return -> list of the pipeline results.
+    async def aggregate(self, pipeline: list) -> list:
+        """ Aggregate results from the AAC database """
+        if not self.native:
+            return await self._in_thread(lambda: list(self.shelter.aggregate(pipeline)))
+        if pipeline is not None and type(pipeline) is list:              # pipeline should be list
+            return await self._animals().aggregate(pipeline).to_list(length=None)
+        else:
+            raise Exception("Aggregate error: invalid pipeline parameter")  # Raise exception with improper input
+
+    # Value count method, like AnimalShelter.value_counts.
+    # Return -> list of (value, count) pairs, most frequent first.
+    async def value_counts(self, query, field: str) -> list:
+        """ Count the animals with each value of a field in the AAC database """
+        if not self.native:
+            return await self._in_thread(lambda: self.shelter.value_counts(query, field))
+        pipeline = AnimalShelter.count_pipeline(query, field)
+        return [(group['_id'], group['count']) for group in await self.aggregate(pipeline)]
+
+    # Run method used by code that is not async, such as Dash callbacks, to run several queries at once.
+    # Input -> coroutines of this class, e.g. shelter.run(shelter.read(query), shelter.count(query)).
+    # Return -> list of their results in the same order; the time taken is that of the slowest query.
+    def run(self, *coroutines) -> list:
+        """ Run queries on the AAC database concurrently and wait for all of them """
+        return asyncio.run_coroutine_threadsafe(self.gather(*coroutines), self._start()).result()
+
+    # Gather method used by async code to run several queries at once.
+    # Return -> list of the query results in the same order.
+    @staticmethod
+    async def gather(*coroutines) -> list:
+        """ Run queries on the AAC database concurrently """
+        return list(await asyncio.gather(*coroutines))
+
+    # Close method stops the event loop and threads; they are started again when needed.
+    def close(self) -> None:
+        """ Stop the event loop and threads used for queries """
+        with self.lock:
+            if self.pid == os.getpid():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.executor.shutdown(wait=False)
+                if self.motor_client is not None:
+                    self.motor_client.close()
+            self.pid, self.loop, self.executor, self.motor_client = None, None, None, None
+
+    # Start the event loop, threads and motor client of this process, again after a fork
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.pid != os.getpid():
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='async-shelter', daemon=True).start()
+                self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='async-shelter')
+                self.motor_client = None
+                self.pid = os.getpid()
+            return self.loop
+
+    # Animals collection of the motor client, created on the event loop the first time it is needed
+    def _animals(self):
+        if self.motor_client is None:
+            settings = self.shelter.settings
+            self.motor_client = AsyncIOMotorClient(settings['uri'],
+                                                   username=settings['username'],
+                                                   password=settings['password'],
+                                                   io_loop=asyncio.get_running_loop(),
+                                                   **settings['options'])
+        return self.motor_client[self.shelter.settings['database']].animals
+
+    # Run a blocking AnimalShelter call in the thread pool
+    async def _in_thread(self, call):
+        if self.pid != os.getpid():
+            self._start()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
@@ -0,0 +1,223 @@
+# Benchmark of the dashboard callbacks on synthetic shelter data of several sizes, reporting the p50 and p99
+# latency and the peak memory of each callback, to catch regressions before a deploy.
+# Usage: python benchmarks/bench_callbacks.py [rows ...] [--interactions 50] [--uri mongodb://localhost:27017]
+#                                             [--no-memory-cache] [--save results.json]
+#                                             [--baseline results.json] [--tolerance 1.5]
+# Without --uri the data is loaded into mongomock, which is fine up to about 100k rows; use a local mongod for
+# larger sizes and to include MongoDB in the measurements. The data goes to the AAC_benchmark database.
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import flask
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from animal_shelter import AnimalShelter  # noqa: E402
+import synthetic_data                     # noqa: E402
+
+try:
+    import mongomock                      # optional in-memory stand-in for MongoDB
+except ImportError:
+    mongomock = None
+
+# Database the synthetic data is written to, so the AAC database is never changed
+database_name = 'AAC_benchmark'
+
+# Callbacks in the order one interaction runs them
+callbacks = ['update_dropdowns', 'update_result', 'update_dashboard', 'update_graphs', 'update_map', 'pan_map',
+             'update_trends']
+
+
+# Point the dashboard at the benchmark database, on a local mongod or an in-memory mongomock client.
+# This must run before web_dashboard is imported, as the dashboard starts loading its data when imported.
+def use_database(uri):
+    os.environ['AAC_MONGO_DATABASE'] = database_name
+    if uri:
+        os.environ['AAC_MONGO_URI'] = uri
+    elif mongomock is None:
+        raise Exception("Benchmark error: install mongomock or give the URI of a local mongod with --uri")
+    else:
+        AnimalShelter.use_client(mongomock.MongoClient())
+
+
+# Fill the benchmark database with synthetic outcomes.
+# Input -> number of outcomes and random seed.
+# Return -> AnimalShelter connected to the benchmark database.
+def load_synthetic_data(rows, seed=0):
+    shelter = AnimalShelter()
+    shelter.client.drop_database(database_name)
+    shelter.create_many(synthetic_data.documents(rows, seed), batch_size=10000)
+    return shelter
+
+
+# Dashboard selections of simulated users: an animal type, sometimes a breed and a sex, an age range
+# and sometimes a table filter.
+# Return -> list of (type, breed, sex, age range, filter query) selections.
+def make_interactions(count, seed=0):
+    rng = np.random.default_rng(seed)
+    selections = []
+    for animal_type in synthetic_data.choose(rng, synthetic_data.animal_types, count):
+        breed = synthetic_data.choose(rng, synthetic_data.breeds[animal_type], 1)[0] if rng.random() < 0.5 else ''
+        sex = synthetic_data.choose(rng, synthetic_data.sexes, 1)[0] if rng.random() < 0.3 else ''
+        low = int(rng.choice([0, 0, 10, 50]))
+        age_range = [low, int(rng.choice([1200, 500, 200])) if low else 1200]
+        filter_query = '{name} contains "' + str(rng.choice(['a', 'e', 'Lu'])) + '"' if rng.random() < 0.2 else ''
+        selections.append((animal_type, breed, sex, age_range, filter_query))
+    return selections
+
+
+# Run the callbacks of one interaction the way the browser triggers them, without cached results.
+# Input -> dashboard module, selection from make_interactions, and whether to measure the peak memory
+#          allocated by each callback instead of its time; tracemalloc must be started to measure memory.
+# Return -> dictionary of callback name -> seconds taken, or MB allocated at the peak.
+def run_interaction(dashboard, selection, memory=False):
+    animal_type, breed, sex, age_range, filter_query = selection
+    dashboard.results.clear()
+    dashboard.result_store.clear()
+    measures = {}
+
+    def run(name, function, *args, triggered=None):
+        if triggered:
+            flask.g.triggered_inputs = [{'prop_id': triggered, 'value': None}]   # read by dash.callback_context
+        if memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function.__wrapped__(*args)
+        measures[name] = tracemalloc.get_traced_memory()[1] / 1024 ** 2 if memory else time.perf_counter() - start
+        return result
+
+    page_size = dashboard.table_page_size
+    run('update_dropdowns', dashboard.update_dropdowns, animal_type, breed, sex)
+    store, page_current = run('update_result', dashboard.update_result, sex, animal_type, breed, age_range,
+                              filter_query)
+    run('update_dashboard', dashboard.update_dashboard, store, 0, page_size, None, [], triggered='result-store.data')
+    run('update_graphs', dashboard.update_graphs, store, 0, None, page_size)
+    run('update_map', dashboard.update_map, store, [], dashboard.map_zoom, None, 0, None, page_size,
+        triggered='result-store.data')
+    run('pan_map', dashboard.update_map, store, [], 12, [[30.25, -97.80], [30.35, -97.70]], 0, None, page_size,
+        triggered='animal-map.bounds')
+    run('update_trends', dashboard.update_trends, animal_type)
+    return measures
+
+
+# Measure the peak memory allocated by each callback of one interaction, in MB
+def measure_memory(dashboard, selection):
+    tracemalloc.start()
+    try:
+        return run_interaction(dashboard, selection, memory=True)
+    finally:
+        tracemalloc.stop()
+
+
+# Load each size of synthetic data into the dashboard and time every callback over the same interactions.
+# Return -> dictionary of rows -> callback -> {'p50_ms', 'p99_ms', 'peak_mb'}, with the memory of the data.
+def benchmark(sizes, interactions, seed=0, memory_cache=True):
+    report = {}
+    dashboard = None
+    selections = make_interactions(interactions, seed)
+    for rows in sizes:
+        start = time.perf_counter()
+        load_synthetic_data(rows, seed)
+        generated = time.perf_counter() - start
+
+        # Load the dashboard data for this size, without following changes during the benchmark
+        if dashboard is None:
+            import web_dashboard as dashboard                    # starts loading the data when imported
+            dashboard.load_data()                                # wait for it before loading it again
+            dashboard.prefetcher.stop()                          # time every interaction cold
+            dashboard.prefetch_results = False
+            dashboard.use_memory_cache = memory_cache
+        if dashboard.cache is not None:
+            dashboard.cache.stop()
+        if dashboard.rollups is not None:
+            dashboard.rollups.stop()
+        if dashboard.facets is not None:
+            dashboard.facets.stop()
+        dashboard.reset_data()
+        start = time.perf_counter()
+        dashboard.load_data()
+        loaded = time.perf_counter() - start
+        if dashboard.cache is not None:
+            dashboard.cache.stop()
+        if dashboard.rollups is not None:
+            dashboard.rollups.stop()
+        dashboard.facets.stop()
+
+        # Time the interactions, then measure the memory of one
+        with dashboard.server.test_request_context():
+            run_interaction(dashboard, selections[0])           # warm up
+            times = {name: [] for name in callbacks}
+            for selection in selections:
+                for name, seconds in run_interaction(dashboard, selection).items():
+                    times[name].append(seconds)
+            peaks = measure_memory(dashboard, selections[0])
+
+        report[rows] = {name: {'p50_ms': float(np.percentile(times[name], 50)) * 1000,
+                               'p99_ms': float(np.percentile(times[name], 99)) * 1000,
+                               'peak_mb': peaks[name]} for name in callbacks}
+        report[rows]['data'] = {'generate_s': generated, 'load_s': loaded,
+                                'frame_mb': dashboard.cache.frame.memory_usage(deep=True).sum() / 1024 ** 2
+                                if dashboard.cache is not None else None}
+    return report
+
+
+# Print the report as a table
+def print_report(report):
+    print("{:>9} {:<18} {:>10} {:>10} {:>10}".format('rows', 'callback', 'p50 ms', 'p99 ms', 'peak MB'))
+    for rows, results in report.items():
+        for name in callbacks:
+            result = results[name]
+            print("{:>9} {:<18} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+                rows, name, result['p50_ms'], result['p99_ms'], result['peak_mb']))
+        data = results['data']
+        print("{:>9} data generated in {generate_s:.1f} s, loaded in {load_s:.1f} s{memory}".format(
+            rows, memory=', {:.1f} MB in memory'.format(data['frame_mb']) if data['frame_mb'] is not None else '',
+            **data))
+
+
+# Compare the p99 latencies with a saved report.
+# Return -> list of regressions, callbacks whose p99 latency grew by more than the tolerance factor.
+def compare(report, baseline, tolerance):
+    regressions = []
+    for rows, results in report.items():
+        for name in callbacks:
+            before = baseline.get(str(rows), {}).get(name)
+            if before and results[name]['p99_ms'] > before['p99_ms'] * tolerance:
+                regressions.append("{rows} rows {name}: p99 {after:.2f} ms, was {before:.2f} ms".format(
+                    rows=rows, name=name, after=results[name]['p99_ms'], before=before['p99_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard callbacks on synthetic data")
+    parser.add_argument('sizes', type=int, nargs='*', default=[10000, 100000], help="rows of data, e.g. 10000 5000000")
+    parser.add_argument('--interactions', type=int, default=50, help="interactions timed for each size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--uri', help="MongoDB URI of a local mongod, otherwise mongomock is used")
+    parser.add_argument('--no-memory-cache', action='store_true', help="query MongoDB instead of the in-memory copy")
+    parser.add_argument('--save', help="write the report to a JSON file")
+    parser.add_argument('--baseline', help="JSON report to compare the p99 latencies with")
+    parser.add_argument('--tolerance', type=float, default=1.5, help="allowed p99 growth over the baseline")
+    args = parser.parse_args()
+
+    use_database(args.uri)
+    report = benchmark(args.sizes, args.interactions, args.seed, not args.no_memory_cache)
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("Regression :: " + regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Benchmark comparing the map marker data of update_map with the original per-row loop: GeoJSON features built
+# by map_layer.to_geojson, one dictionary per row, and the compact columns of map_layer.to_payload, which the
+# dashboard sends by default and the browser turns into features. Each is timed until it is serialized to JSON
+# the way Dash sends it.
+# Usage: python benchmarks/bench_map.py [rows ...]
+
+import json
+import os
+import sys
+import timeit
+
+import dash_leaflet.express as dlx
+import numpy as np
+import pandas as pd
+import plotly.utils
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import map_layer  # noqa: E402
+import payload    # noqa: E402
+
+
+# Create a DataFrame with the columns used by the map
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'name': rng.choice(['Lucy', 'Max', 'Bella', ''], rows),
+        'animal_type': rng.choice(['Dog', 'Cat', 'Bird', 'Other'], rows),
+        'breed': rng.choice(['Labrador Retriever Mix', 'Domestic Shorthair Mix', 'Pit Bull Mix'], rows),
+        'age_upon_outcome_in_weeks': rng.uniform(0, 1000, rows),
+        'sex_upon_outcome': rng.choice(['Neutered Male', 'Spayed Female', 'Intact Male', 'Intact Female'], rows),
+        'location_lat': rng.uniform(30.0, 30.8, rows),
+        'location_long': rng.uniform(-98.0, -97.3, rows),
+    })
+
+
+# Original marker loop from update_map
+def loop_markers(dff):
+    lats = dff['location_lat'].to_list()
+    lons = dff['location_long'].to_list()
+    animal_names = dff['name'].to_list()
+    animal_types = dff['animal_type'].to_list()
+    animal_breeds = dff['breed'].to_list()
+    animal_ages = dff['age_upon_outcome_in_weeks'].to_list()
+    animal_sexes = dff['sex_upon_outcome'].to_list()
+    markers = []
+    for i in range(len(lats)):
+        markers += [
+            dict(lat=lats[i],
+                 lon=lons[i],
+                 tooltip=animal_names[i] if animal_names[i] else "Unnamed",
+                 popup="<body><h4>Name: " + str(animal_names[i] if animal_names[i] else "Unnamed") + "</h4>"
+                       + "Type: " + str(animal_types[i]) + "<br>"
+                       + "Breed: " + str(animal_breeds[i]) + "<br>"
+                       + "Age: " + str(int(animal_ages[i])) + " weeks<br>"
+                       + "Sex: " + str(animal_sexes[i]) + "</body>"
+            )
+        ]
+    return dlx.dicts_to_geojson(markers)
+
+
+# Marker properties of update_map
+def marker_properties(dff):
+    return {'tooltip': map_layer.tooltips(dff), 'popup': map_layer.popups(dff)}
+
+
+# GeoJSON markers, used by update_map without compact payloads
+def geojson_markers(dff):
+    return map_layer.to_geojson(dff, marker_properties(dff))
+
+
+# Compact column markers, used by update_map by default
+def payload_markers(dff):
+    return map_layer.to_payload(dff, marker_properties(dff))
+
+
+# Features of compact column markers, built the way assets/payload.js does in the browser
+def payload_features(compact):
+    return [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [record.pop('lon'), record.pop('lat')]},
+             'properties': record} for record in payload.decode_records(compact)]
+
+
+# Time the implementations, reporting the best of several runs
+def main(sizes):
+    print("{:>8} {:>10} {:>11} {:>8} {:>11} {:>8}".format('rows', 'loop ms', 'geojson ms', 'speedup',
+                                                          'payload ms', 'speedup'))
+    for rows in sizes:
+        dff = make_frame(rows)
+        expected = loop_markers(dff)
+        assert geojson_markers(dff) == expected                              # all build the same GeoJSON
+        assert payload_features(payload_markers(dff)) == expected['features']
+        number = max(1, 10000 // rows)
+        times = [min(timeit.repeat(lambda: json.dumps(markers(dff), cls=plotly.utils.PlotlyJSONEncoder),
+                                   number=number, repeat=5)) / number
+                 for markers in (loop_markers, geojson_markers, payload_markers)]
+        print("{:>8} {:>10.2f} {:>11.2f} {:>7.1f}x {:>11.2f} {:>7.1f}x".format(
+            rows, times[0] * 1000, times[1] * 1000, times[0] / times[1], times[2] * 1000, times[0] / times[2]))
+
+
+if __name__ == '__main__':
+    main([int(rows) for rows in sys.argv[1:]] or [1000, 10000, 100000])
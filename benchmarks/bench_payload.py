@@ -0,0 +1,84 @@
+# Benchmark comparing the size of the table, map and chart data sent to the browser as rows of JSON objects
+# with the compact column payloads of payload.py, uncompressed and compressed the way Flask-Compress does.
+# Usage: python benchmarks/bench_payload.py [rows ...]
+# The default of 10000 rows is about the size of the AAC outcomes dataset.
+
+import gzip
+import json
+import os
+import sys
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.utils
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import map_layer                          # noqa: E402
+import payload                            # noqa: E402
+import synthetic_data                     # noqa: E402
+
+try:
+    import brotli                         # optional, installed with Flask-Compress on most platforms
+except ImportError:
+    brotli = None
+
+# Compression levels Flask-Compress uses by default
+gzip_level = 6
+brotli_quality = 4
+
+# Pie chart template of web_dashboard with compact payloads
+pie_chart_template = go.layout.Template(layout={'colorway': px.colors.qualitative.Plotly},
+                                        data={'pie': [{'automargin': True}]})
+
+
+# Sizes in bytes of a response, as sent by Dash, uncompressed and compressed
+def sizes(data):
+    raw = json.dumps(data, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+    return (len(raw), len(gzip.compress(raw, gzip_level)),
+            len(brotli.compress(raw, quality=brotli_quality)) if brotli is not None else None)
+
+
+# Build the outputs of one interaction showing every animal, in both formats.
+# Return -> list of (output name, rows format, compact format).
+def make_outputs(frame, page_size=10, zoom=9):
+    page = frame.head(page_size)
+    clusters, points = map_layer.cluster(frame, zoom)
+    marker_properties = {'id': points.index.astype(str), 'tooltip': map_layer.tooltips(points)}
+    popup_properties = {'tooltip': map_layer.tooltips(page), 'popup': map_layer.popups(page)}
+    all_properties = {'id': frame.index.astype(str), 'tooltip': map_layer.tooltips(frame)}
+
+    counts = frame['breed'].value_counts()
+    labels = ["{:<40}".format(str(label)[:40]) for label in counts.index[:10]] + ['Other']
+    values = counts.to_list()[:10] + [int(counts.iloc[10:].sum())]
+
+    return [
+        ('table page', page.to_dict('records'), payload.encode_frame(page)),
+        ('map markers zoom {}'.format(zoom), map_layer.to_geojson(points, marker_properties),
+         map_layer.to_payload(points, marker_properties)),
+        ('map all markers', map_layer.to_geojson(frame, all_properties),
+         map_layer.to_payload(frame, all_properties)),
+        ('page markers', map_layer.to_geojson(page, popup_properties),
+         map_layer.to_payload(page, popup_properties)),
+        ('pie chart', px.pie(values=values, names=labels, hole=.4),
+         px.pie(values=values, names=labels, hole=.4, template=pie_chart_template)),
+    ]
+
+
+# Print the sizes of both formats of each output, checking the compact format decodes to the same data
+def main(sizes_in_rows):
+    print("{:>8} {:<20} {:>7} {:>10} {:>10} {:>10}".format('rows', 'output', 'format', 'raw', 'gzip', 'brotli'))
+    for rows in sizes_in_rows:
+        frame = synthetic_data.make_frame(rows)
+        frame = frame[np.isfinite(frame[map_layer.lat_column].to_numpy(dtype=float))]
+        for name, records, compact in make_outputs(frame):
+            if isinstance(records, list):
+                assert payload.decode_records(compact) == json.loads(json.dumps(records)), name
+            for label, data in (('rows', records), ('compact', compact)):
+                raw, gzipped, brotlied = sizes(data)
+                print("{:>8} {:<20} {:>7} {:>10,} {:>10,} {:>10}".format(
+                    rows, name, label, raw, gzipped, '{:,}'.format(brotlied) if brotlied is not None else '-'))
+
+
+if __name__ == '__main__':
+    main([int(rows) for rows in sys.argv[1:]] or [10000])
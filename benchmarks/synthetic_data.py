@@ -0,0 +1,170 @@
+# Generator of synthetic Austin Animal Center outcome documents with the fields and value distributions of the
+# real AAC collection, used by the benchmarks and to try the dashboard without the real data.
+# Usage: python benchmarks/synthetic_data.py rows output.csv|output.ndjson [--seed 0]
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Share of each animal type, and its breeds with their shares
+animal_types = {'Dog': 0.56, 'Cat': 0.37, 'Other': 0.05, 'Bird': 0.015, 'Livestock': 0.005}
+breeds = {
+    'Dog': {'Pit Bull Mix': 0.14, 'Labrador Retriever Mix': 0.12, 'Chihuahua Shorthair Mix': 0.11,
+            'German Shepherd Mix': 0.06, 'Australian Cattle Dog Mix': 0.03, 'Dachshund Mix': 0.03,
+            'Boxer Mix': 0.02, 'Border Collie Mix': 0.02, 'Miniature Poodle Mix': 0.02, 'Siberian Husky Mix': 0.02,
+            'Catahoula Mix': 0.02, 'Yorkshire Terrier Mix': 0.02, 'Jack Russell Terrier Mix': 0.02,
+            'Beagle Mix': 0.02, 'Great Pyrenees Mix': 0.015, 'Rottweiler Mix': 0.015, 'Shih Tzu Mix': 0.015,
+            'Chihuahua Longhair Mix': 0.01, 'Labrador Retriever': 0.01, 'Pit Bull': 0.01,
+            'Border Collie/Labrador Retriever': 0.005, 'Pointer Mix': 0.005, 'Golden Retriever Mix': 0.005,
+            'Plott Hound Mix': 0.005, 'Staffordshire Mix': 0.005},
+    'Cat': {'Domestic Shorthair Mix': 0.78, 'Domestic Medium Hair Mix': 0.07, 'Domestic Longhair Mix': 0.04,
+            'Siamese Mix': 0.04, 'Domestic Shorthair': 0.04, 'American Shorthair Mix': 0.01, 'Snowshoe Mix': 0.01,
+            'Maine Coon Mix': 0.005, 'Manx Mix': 0.005},
+    'Other': {'Bat Mix': 0.35, 'Raccoon Mix': 0.2, 'Rabbit Sh Mix': 0.2, 'Opossum Mix': 0.1, 'Skunk Mix': 0.1,
+              'Guinea Pig Mix': 0.05},
+    'Bird': {'Chicken Mix': 0.4, 'Pigeon Mix': 0.3, 'Parakeet Mix': 0.2, 'Duck Mix': 0.1},
+    'Livestock': {'Pig Mix': 0.6, 'Goat Mix': 0.4},
+}
+
+# Share of each sex of dogs and cats, other animals are mostly of unknown sex
+sexes = {'Neutered Male': 0.34, 'Spayed Female': 0.31, 'Intact Male': 0.13, 'Intact Female': 0.12, 'Unknown': 0.10}
+other_sexes = {'Unknown': 0.8, 'Intact Male': 0.1, 'Intact Female': 0.1}
+
+# Outcomes with their subtypes
+outcomes = {'Adoption': 0.42, 'Transfer': 0.30, 'Return to Owner': 0.17, 'Euthanasia': 0.08, 'Died': 0.01,
+            'Rto-Adopt': 0.01, 'Disposal': 0.01}
+subtypes = {'Transfer': ['Partner', 'SCRP', 'Snr'], 'Euthanasia': ['Suffering', 'Rabies Risk', 'Aggressive'],
+            'Adoption': ['', 'Foster', 'Offsite']}
+
+colors = ['Black/White', 'Black', 'Brown Tabby', 'Brown Tabby/White', 'White', 'Brown/White', 'Tan/White',
+          'Orange Tabby', 'Blue/White', 'Tricolor', 'Tan', 'Black/Tan', 'Calico', 'Tortie', 'Brown']
+names = ['Max', 'Bella', 'Luna', 'Charlie', 'Lucy', 'Daisy', 'Rocky', 'Buddy', 'Coco', 'Lola', 'Oreo', 'Milo',
+         'Princess', 'Jack', 'Lily', 'Toby', 'Oliver', 'Shadow', 'Zeus', 'Bear', 'Sadie', 'Chloe', 'Duke', 'Rex']
+
+# Shelter neighborhoods around Austin the animals were found in, as (latitude, longitude, spread, share)
+neighborhoods = [(30.27, -97.74, 0.06, 0.35), (30.39, -97.70, 0.05, 0.2), (30.20, -97.78, 0.05, 0.15),
+                 (30.45, -97.80, 0.06, 0.1), (30.33, -97.62, 0.05, 0.1), (30.52, -97.66, 0.07, 0.1)]
+
+# First and last outcome dates
+first_date = pd.Timestamp('2013-10-01')
+last_date = pd.Timestamp('2018-05-01')
+
+# Column order of the AAC collection
+columns = ['', 'age_upon_outcome', 'animal_id', 'animal_type', 'breed', 'color', 'date_of_birth', 'datetime',
+           'monthyear', 'name', 'outcome_subtype', 'outcome_type', 'sex_upon_outcome', 'location_lat',
+           'location_long', 'age_upon_outcome_in_weeks']
+
+
+# Choose values with the given shares
+def choose(rng, shares, size):
+    values = list(shares)
+    weights = np.array([shares[value] for value in values], dtype=float)
+    return np.array(values, dtype=object)[rng.choice(len(values), size, p=weights / weights.sum())]
+
+
+# Describe an age in weeks the way the AAC data does, e.g. "2 years", "3 months" or "1 week"
+def describe_ages(weeks):
+    days = np.floor(weeks * 7).astype(np.int64)
+    amounts = np.where(days >= 365, days // 365, np.where(days >= 30, days // 30, np.where(days >= 7, days // 7,
+                                                                                         days)))
+    units = np.where(days >= 365, 'year', np.where(days >= 30, 'month', np.where(days >= 7, 'week', 'day')))
+    return [str(amount) + ' ' + unit + ('' if amount == 1 else 's') for amount, unit in zip(amounts, units)]
+
+
+# Generate a DataFrame of synthetic outcomes.
+# Input -> number of rows, random seed and the number of the first row.
+# Return -> DataFrame with the columns of the AAC collection.
+def make_frame(rows, seed=0, start=0):
+    rng = np.random.default_rng([seed, start])
+    types = choose(rng, animal_types, rows)
+
+    # Breeds and sexes depend on the animal type
+    breed = np.empty(rows, dtype=object)
+    sex = choose(rng, sexes, rows)
+    for animal_type, type_breeds in breeds.items():
+        selected = types == animal_type
+        breed[selected] = choose(rng, type_breeds, int(selected.sum()))
+        if animal_type not in ('Dog', 'Cat'):
+            sex[selected] = choose(rng, other_sexes, int(selected.sum()))
+
+    # Most animals leave the shelter young, cats younger than dogs
+    weeks = rng.lognormal(mean=np.where(types == 'Cat', 3.0, 4.2), sigma=1.1)
+    weeks = np.round(np.clip(weeks, 0.14, 1200), 6)
+
+    # Outcome dates, and birth dates from the age
+    seconds = rng.integers(0, int((last_date - first_date).total_seconds()), rows)
+    outcome_dates = np.datetime64(first_date, 's') + seconds.astype('timedelta64[s]')
+    birth_dates = (outcome_dates - np.round(weeks * 7 * 86400).astype('timedelta64[s]')).astype('datetime64[D]')
+    outcome_times = np.datetime_as_string(outcome_dates, unit='s')
+
+    # Locations spread around the shelter neighborhoods
+    area = rng.choice(len(neighborhoods), rows, p=[share for lat, lon, spread, share in neighborhoods])
+    centers = np.array([[lat, lon, spread] for lat, lon, spread, share in neighborhoods])[area]
+    lats = np.round(centers[:, 0] + rng.normal(0, 1, rows) * centers[:, 2], 6)
+    lons = np.round(centers[:, 1] + rng.normal(0, 1, rows) * centers[:, 2], 6)
+
+    # Outcomes and their subtypes
+    outcome = choose(rng, outcomes, rows)
+    subtype = np.full(rows, '', dtype=object)
+    for outcome_type, choices in subtypes.items():
+        selected = outcome == outcome_type
+        subtype[selected] = np.array(choices, dtype=object)[rng.integers(0, len(choices), int(selected.sum()))]
+
+    # About a third of the animals have no name
+    name = np.array(names, dtype=object)[rng.integers(0, len(names), rows)]
+    name[rng.random(rows) < 0.32] = ''
+
+    return pd.DataFrame({
+        '': np.arange(start, start + rows) + 1,
+        'age_upon_outcome': describe_ages(weeks),
+        'animal_id': ['A%06d' % number for number in rng.integers(300000, 780000, rows)],
+        'animal_type': types,
+        'breed': breed,
+        'color': np.array(colors, dtype=object)[rng.integers(0, len(colors), rows)],
+        'date_of_birth': np.datetime_as_string(birth_dates, unit='D').astype(object),
+        'datetime': np.char.replace(outcome_times, 'T', ' ').astype(object),
+        'monthyear': outcome_times.astype(object),
+        'name': name,
+        'outcome_subtype': subtype,
+        'outcome_type': outcome,
+        'sex_upon_outcome': sex,
+        'location_lat': lats,
+        'location_long': lons,
+        'age_upon_outcome_in_weeks': weeks,
+    }, columns=columns)
+
+
+# Generate synthetic outcome documents in chunks, so millions of documents are not held at once.
+# Input -> number of documents, random seed and the number of documents generated at a time.
+# Return -> generator of documents ready for AnimalShelter.create_many.
+def documents(rows, seed=0, chunk_size=100000):
+    for start in range(0, rows, chunk_size):
+        frame = make_frame(min(chunk_size, rows - start), seed, start)
+        for record in frame.to_dict('records'):
+            yield {key: value.item() if isinstance(value, np.generic) else value for key, value in record.items()}
+
+
+# Write synthetic outcomes to a CSV file, or a newline-delimited JSON file, for import_animals.py
+def write(path, rows, seed=0, chunk_size=100000):
+    if os.path.splitext(path)[1].lower() in ('.ndjson', '.jsonl', '.json'):
+        with open(path, 'w') as output:
+            for document in documents(rows, seed, chunk_size):
+                output.write(json.dumps(document) + '\n')
+        return
+    with open(path, 'w', newline='') as output:
+        for start in range(0, rows, chunk_size):
+            make_frame(min(chunk_size, rows - start), seed, start).to_csv(output, header=start == 0, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic Austin Animal Center outcomes")
+    parser.add_argument('rows', type=int, help="number of outcomes, e.g. 10000 to 5000000")
+    parser.add_argument('path', help="output .csv file, or .ndjson/.jsonl file with one document per line")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write(args.path, args.rows, args.seed)
+    print("Wrote {rows} outcomes to {path}".format(rows=args.rows, path=args.path), file=sys.stderr)
@@ -0,0 +1,133 @@
+# Python module that indexes the animal type, breed and sex combinations in MongoDB for the dashboard menus.
+
+import math
+import threading
+
+from animal_shelter import AnimalShelter
+
+
+class FacetIndex(object):
+    """ Counts and age limits for every animal type, breed and sex combination """
+
+    # Fields the dashboard menus filter on, in the order used for the combination keys
+    facet_fields = ['animal_type', 'breed', 'sex_upon_outcome']
+
+    # Field the age range slider filters on
+    age_field = 'age_upon_outcome_in_weeks'
+
+    # Initialize FacetIndex object
+    # Input -> AnimalShelter used to build the index, seconds between checks for writes made by other processes
+    #          or AnimalShelter objects, and whether to check for them in a background thread. Inserts made through
+    #          the shelter are added right away, other writes are applied by the background thread, which rebuilds
+    #          the index once for a burst of them, or by the next catch_up without it.
+    def __init__(self, shelter: AnimalShelter, poll_interval: float = 5.0, follow: bool = True) -> None:
+        self.shelter = shelter
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()          # one change of the facets and versions at a time
+        self.facets = {}                      # (type, breed, sex) -> [count, age_min, age_max]
+        self.data_version = 0                 # AnimalShelter data version the index is current with
+        self.added_version = None             # data version of the inserts added since the last rebuild
+        self.dirty = threading.Event()        # set by writes the index could not apply in place
+        self.stopped = threading.Event()
+        self.rebuild()
+        shelter.add_listener(self.on_write)
+
+        # Follow writes made elsewhere in the background
+        self.thread = None
+        if follow:
+            self.thread = threading.Thread(target=self._follow, name='facet-index', daemon=True)
+            self.thread.start()
+
+    # Rebuild method reads the combinations from the collection with a single $group aggregation.
+    # A write made while it runs may or may not be counted, so the index is marked dirty to be rebuilt again.
+    def rebuild(self) -> None:
+        """ Build the facet index from the Animal collection """
+        pipeline = [{'$group': {'_id': {field: '$' + field for field in self.facet_fields},
+                                'count': {'$sum': 1},
+                                'age_min': {'$min': '$' + self.age_field},
+                                'age_max': {'$max': '$' + self.age_field}}}]
+        data_version = self.shelter.version()                           # read the version first so no write is missed
+        facets = {}
+        for group in self.shelter.aggregate(pipeline):
+            key = tuple(group['_id'].get(field) for field in self.facet_fields)
+            facets[key] = [group['count'], group['age_min'], group['age_max']]
+        with self.lock:
+            self.facets = facets
+            self.data_version, self.added_version = data_version, None
+        if self.shelter.version() != data_version:
+            self.dirty.set()
+
+    # Catch up method rebuilds the index when it is dirty or the collection was written since it was built,
+    # e.g. by another process.
+    def catch_up(self) -> None:
+        """ Bring the facet index up to date with the Animal collection """
+        if self.dirty.is_set() or self.shelter.version() != self.data_version:
+            self.dirty.clear()
+            self.rebuild()
+
+    # Write listener keeps the index current; inserts following the index's data version are added in place,
+    # other writes mark the index dirty for the background thread to rebuild, because the minimum and maximum
+    # ages of the changed combinations cannot be recovered from the query.
+    def on_write(self, operation: str, data: dict) -> None:
+        """ Update the facet index after a write to the Animal collection """
+        if operation != 'create' or not self._add(data):
+            self.dirty.set()
+
+    # Options method to find the menu options and age limits consistent with the current selections.
+    # Input -> selected animal type, breed and sex, where an empty selection matches every value.
+    # Return -> dictionary with the count of animals for each value of each field, and the age limits.
+    def options(self, animal_type: str = None, breed: str = None, sex: str = None) -> dict:
+        """ Get the menu options and age limits for a selection """
+        selected = (animal_type, breed, sex)
+        counts = {field: {} for field in self.facet_fields}
+        age_min, age_max = math.inf, -math.inf
+
+        # Visit each distinct combination once instead of every matching animal
+        for key, (count, key_min, key_max) in list(self.facets.items()):
+            if any(value and value != key_value for value, key_value in zip(selected, key)):
+                continue
+            for field, key_value in zip(self.facet_fields, key):
+                counts[field][key_value] = counts[field].get(key_value, 0) + count
+            if key_min is not None:
+                age_min = min(age_min, key_min)
+            if key_max is not None:
+                age_max = max(age_max, key_max)
+
+        return {'counts': counts,
+                'age_min': age_min if age_min != math.inf else 0,
+                'age_max': age_max if age_max != -math.inf else 0}
+
+    # Stop following writes to the collection
+    def stop(self) -> None:
+        """ Stop the background thread that keeps the index current """
+        self.stopped.set()
+        self.dirty.set()
+
+    # Rebuild when the index is marked dirty, and poll the data version for writes made elsewhere
+    def _follow(self) -> None:
+        while not self.stopped.is_set():
+            self.dirty.wait(self.poll_interval)
+            if self.stopped.is_set():
+                return
+            try:
+                self.catch_up()
+            except Exception as e:                                       # keep polling if the database is unavailable
+                print("An exception occurred ::", e)
+
+    # Add one inserted document to the index and advance its data version, when the document was written right
+    # after the index's data version, or in the same batch as the last document added.
+    # Return -> True if the document was added, False if other writes may be missing from the index.
+    def _add(self, document: dict) -> bool:
+        version = document.get('_version')
+        key = tuple(document.get(field) for field in self.facet_fields)
+        age = document.get(self.age_field)
+        with self.lock:
+            if version is None or not (version == self.data_version + 1 or version == self.added_version):
+                return False
+            count, age_min, age_max = self.facets.get(key, [0, None, None])
+            if age is not None:
+                age_min = age if age_min is None else min(age_min, age)
+                age_max = age if age_max is None else max(age_max, age)
+            self.facets[key] = [count + 1, age_min, age_max]
+            self.data_version = self.added_version = version
+            return True
@@ -0,0 +1,42 @@
+# Command line tool that loads an Austin Animal Center outcomes export into MongoDB.
+# Usage: python import_animals.py outcomes.csv [--upsert animal_id,datetime] [--batch-size 5000]
+
+import argparse
+import time
+
+from animal_shelter import AnimalShelter  # required module for MongoDB operations
+from outcome_rollups import OutcomeRollups  # outcome counts per month for the dashboard trend charts
+
+
+# Parse the command line, import the file and print a report for every batch
+def main():
+    parser = argparse.ArgumentParser(description="Import a CSV or JSON file of shelter outcomes")
+    parser.add_argument('path', help="CSV file with a header row, or .json/.ndjson/.jsonl file with an array "
+                                     "of documents or one document per line")
+    parser.add_argument('--upsert', default='',
+                        help="comma separated fields identifying existing animals to replace, e.g. animal_id,datetime")
+    parser.add_argument('--batch-size', type=int, default=1000, help="documents written per round trip")
+    parser.add_argument('--username', help="defaults to the AAC_MONGO_USER environment variable")
+    parser.add_argument('--password', help="defaults to the AAC_MONGO_PASSWORD environment variable")
+    args = parser.parse_args()
+
+    shelter = AnimalShelter(args.username, args.password)
+    start = time.perf_counter()
+    summary = shelter.import_file(args.path, [field for field in args.upsert.split(',') if field], args.batch_size)
+
+    # Report each batch with errors, then the totals
+    for report in summary['batches']:
+        for error in report['errors']:
+            print("Batch {batch}, document {index}: {message}".format(batch=report['batch'], **error))
+    print("Inserted {inserted}, upserted {upserted}, modified {modified}, {errors} errors "
+          "in {batches} batches, {seconds:.1f} s".format(batches=len(summary['batches']),
+                                                          seconds=time.perf_counter() - start, **summary))
+
+    # Recount the months of the imported outcomes for the dashboard trend charts
+    start = time.perf_counter()
+    OutcomeRollups(shelter, follow=False)
+    print("Outcome rollups refreshed in {seconds:.1f} s".format(seconds=time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
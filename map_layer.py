@@ -0,0 +1,117 @@
+# Python module that clusters animal locations on the server for the dashboard map.
+
+import numpy as np
+import pandas as pd
+
+import payload
+
+# Columns holding the animal locations
+lat_column = 'location_lat'
+lon_column = 'location_long'
+
+# Width and height of a map tile in pixels at zoom level 0
+tile_size = 256
+
+
+# Pad map bounds, [[south, west], [north, east]], by a fraction of their size on every side
+# so markers just outside the visible map are already there when the map is dragged
+def pad_bounds(bounds, padding=0.25):
+    (south, west), (north, east) = bounds
+    lat_pad = (north - south) * padding
+    lon_pad = (east - west) * padding
+    return [[max(south - lat_pad, -90), west - lon_pad], [min(north + lat_pad, 90), east + lon_pad]]
+
+
+# Select the animals located within map bounds, [[south, west], [north, east]]
+def within(frame, bounds):
+    (south, west), (north, east) = bounds
+    lats = pd.to_numeric(frame[lat_column], errors='coerce')
+    lons = pd.to_numeric(frame[lon_column], errors='coerce')
+    return frame[lats.between(south, north).to_numpy() & lons.between(west, east).to_numpy()]
+
+
+# Convert latitudes and longitudes to Web Mercator pixel coordinates at a zoom level
+def to_pixels(lats, lons, zoom):
+    scale = tile_size * 2 ** zoom
+    sin_lat = np.clip(np.sin(np.radians(lats)), -0.9999, 0.9999)
+    x = (lons + 180) / 360 * scale
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+    return x, y
+
+
+# Group animals into clusters of nearby locations on a grid of cells cell_size pixels wide at a zoom level.
+# Input -> DataFrame with location columns, the map zoom level, the grid cell size in pixels and the
+#          smallest number of animals shown as a cluster instead of individual markers.
+# Return -> DataFrame of clusters (location_lat, location_long, count) positioned at the mean location
+#           of their animals, and DataFrame of the animals that are not part of a cluster.
+def cluster(frame, zoom, cell_size=60, min_cluster_size=2):
+    locations = frame[[lat_column, lon_column]].apply(pd.to_numeric, errors='coerce')
+    located = locations.notna().all(axis=1).to_numpy()
+    frame, locations = frame[located], locations[located]
+    lats = locations[lat_column].to_numpy(dtype=float)
+    lons = locations[lon_column].to_numpy(dtype=float)
+
+    # Find the grid cell of each animal
+    x, y = to_pixels(lats, lons, int(zoom or 0))
+    cells = np.floor(x / cell_size).astype(np.int64) * (1 << 32) + np.floor(y / cell_size).astype(np.int64)
+    unique_cells, cell_index, counts = np.unique(cells, return_inverse=True, return_counts=True)
+
+    # Average the locations of the animals in each cell
+    clusters = pd.DataFrame({lat_column: np.bincount(cell_index, weights=lats) / counts,
+                             lon_column: np.bincount(cell_index, weights=lons) / counts,
+                             'count': counts})
+
+    # Cells with too few animals are shown as individual markers
+    clustered = counts >= min_cluster_size
+    return clusters[clustered].reset_index(drop=True), frame[~clustered[cell_index]]
+
+
+# Build marker tooltips from animal names, using "Unnamed" for animals without a name
+def tooltips(frame):
+    names = frame['name'].astype(object)
+    return names.where(names.notna() & (names != ''), 'Unnamed').astype(str)
+
+
+# Build marker popups describing each animal, concatenating whole columns of text at a time
+def popups(frame):
+    ages = pd.to_numeric(frame['age_upon_outcome_in_weeks'], errors='coerce').fillna(0).to_numpy().astype(np.int64)
+    return ("<body><h4>Name: " + tooltips(frame) +
+            "</h4>Type: " + _text(frame['animal_type']) +
+            "<br>Breed: " + _text(frame['breed']) +
+            "<br>Age: " + pd.Series(list(map(str, ages.tolist())), index=frame.index, dtype=object) +
+            " weeks<br>Sex: " + _text(frame['sex_upon_outcome']) + "</body>")
+
+
+# Text of a column as an object Series, with missing values left empty, converting each category once
+def _text(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = np.append(column.cat.categories.astype(str).to_numpy(dtype=object), '')
+        return pd.Series(categories[column.cat.codes.to_numpy()], index=column.index, dtype=object)  # -1 is missing
+    column = column.astype(object)
+    return column.where(column.notna(), '').astype(str)
+
+
+# Build a GeoJSON FeatureCollection of points from the location and property columns, in one pass creating a
+# feature dictionary per row, used when compact payloads are off. to_payload sends the columns as they are instead.
+# Input -> DataFrame with location columns and a dictionary of property name -> Series or list of values.
+# Return -> GeoJSON FeatureCollection with one point per row.
+def to_geojson(frame, properties):
+    lats = frame[lat_column].to_numpy(dtype=float).tolist()
+    lons = frame[lon_column].to_numpy(dtype=float).tolist()
+    names = list(properties)
+    rows = zip(*[properties[name].tolist() if hasattr(properties[name], 'tolist') else list(properties[name])
+                 for name in names])
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature',
+                          'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                          'properties': dict(zip(names, row))}
+                         for lon, lat, row in zip(lons, lats, rows)]}
+
+
+# Build the same points as to_geojson in the compact column format of payload.encode_frame,
+# with lat and lon columns, converted back to GeoJSON in the browser by assets/payload.js.
+def to_payload(frame, properties):
+    columns = {'lat': frame[lat_column].to_numpy(dtype=float), 'lon': frame[lon_column].to_numpy(dtype=float)}
+    columns.update((name, values.to_numpy() if hasattr(values, 'to_numpy') else list(values))
+                   for name, values in properties.items())
+    return payload.encode_frame(pd.DataFrame(columns))
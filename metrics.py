@@ -0,0 +1,174 @@
+# Python module that records how long dashboard callbacks and database queries take, exported in the Prometheus
+# text format so a monitoring server can scrape them.
+
+import bisect
+import functools
+import threading
+import time
+
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+
+
+class Metrics(object):
+    """ Histograms and counters of the dashboard and database activity """
+
+    # Histogram buckets for times in seconds, numbers of rows and payload sizes in bytes
+    time_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    row_buckets = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+    byte_buckets = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+    # Metrics exported for each cache added with add_cache, as (name, type, ResultCache.stats key, help text)
+    cache_metrics = (('result_cache_hits_total', 'counter', 'hits', "Results found in memory"),
+                     ('result_cache_shared_hits_total', 'counter', 'shared_hits', "Results found in the shared store"),
+                     ('result_cache_misses_total', 'counter', 'misses', "Results not found"),
+                     ('result_cache_evictions_total', 'counter', 'evictions', "Results evicted from a full cache"),
+                     ('result_cache_entries', 'gauge', 'entries', "Results cached in memory"))
+
+    # Initialize Metrics object
+    # Input -> seconds after which a database query is printed to the slow query log, None to log no queries.
+    def __init__(self, slow_query_seconds: float = None) -> None:
+        self.slow_query_seconds = slow_query_seconds
+        self.lock = threading.Lock()
+        self.metrics = {}                     # name -> {'type', 'help', 'buckets', 'series': {labels: values}}
+        self.caches = {}                      # cache label -> ResultCache whose stats are exported
+        self.histogram('dash_callback_seconds', "Time to run a Dash callback and serialize its response")
+        self.histogram('dash_callback_response_bytes', "Size of a Dash callback response", self.byte_buckets)
+        self.histogram('dashboard_step_seconds', "Time of a step of a dashboard callback, e.g. a DataFrame conversion")
+        self.histogram('shelter_method_seconds', "Time of an AnimalShelter method")
+        self.histogram('shelter_method_rows', "Number of rows returned by an AnimalShelter method", self.row_buckets)
+        self.counter('shelter_slow_queries_total', "AnimalShelter methods slower than the slow query time")
+
+    # Histogram method to declare a histogram.
+    # Input -> metric name, help text and upper bounds of the buckets.
+    def histogram(self, name: str, help_text: str, buckets: tuple = time_buckets) -> None:
+        """ Declare a histogram metric """
+        self.metrics[name] = {'type': 'histogram', 'help': help_text, 'buckets': buckets, 'series': {}}
+
+    # Counter method to declare a counter.
+    # Input -> metric name and help text.
+    def counter(self, name: str, help_text: str) -> None:
+        """ Declare a counter metric """
+        self.metrics[name] = {'type': 'counter', 'help': help_text, 'series': {}}
+
+    # Add cache method to export the hit, miss and eviction counts and the size of a cache with the other metrics.
+    # Input -> label of the cache in the exported series, and a ResultCache.
+    def add_cache(self, name: str, cache) -> None:
+        """ Export the statistics of a result cache """
+        self.caches[name] = cache
+
+    # Observe method to record a value in a histogram, or add it to a counter.
+    # Input -> metric name, value and labels of the series, e.g. observe('dash_callback_seconds', 0.2, callback='x').
+    def observe(self, name: str, value: float, **labels) -> None:
+        """ Record a value of a metric """
+        metric = self.metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if metric['type'] == 'counter':
+                metric['series'][key] = metric['series'].get(key, 0) + value
+                return
+            series = metric['series'].get(key)
+            if series is None:
+                series = metric['series'][key] = {'buckets': [0] * (len(metric['buckets']) + 1), 'sum': 0.0}
+            series['buckets'][bisect.bisect_left(metric['buckets'], value)] += 1
+            series['sum'] += value
+
+    # Timer context manager recording the time taken by the statements in it.
+    # Input -> histogram name and labels, e.g. with metrics.timer('dashboard_step_seconds', step='table records').
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # Shelter observer method, registered with AnimalShelter.add_observer, recording the time and rows of every
+    # method and printing the queries slower than slow_query_seconds.
+    def observe_shelter(self, method: str, seconds: float, rows: int, args: tuple) -> None:
+        """ Record an AnimalShelter method call """
+        self.observe('shelter_method_seconds', seconds, method=method)
+        if rows is not None:
+            self.observe('shelter_method_rows', rows, method=method)
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            self.observe('shelter_slow_queries_total', 1, method=method)
+            query = args[0] if args else None
+            print("Slow query :: {method} took {ms:.0f} ms, {rows} rows: {query}".format(
+                method=method, ms=seconds * 1000, rows=rows,
+                query=query.key() if hasattr(query, 'key') else query))
+
+    # Instrument method to record the time and response size of every callback of a Dash application,
+    # and to serve the metrics on its /metrics route. Call it after the callbacks are defined.
+    def instrument(self, app) -> None:
+        """ Record every Dash callback and add the /metrics route """
+        for callback in app.callback_map.values():
+            if 'callback' in callback:                                   # clientside callbacks run in the browser
+                callback['callback'] = self._timed_callback(callback['callback'])
+        app.server.add_url_rule('/metrics', 'metrics', self._response)
+
+    # Render method to export the metrics.
+    # Return -> metrics in the Prometheus text exposition format.
+    def render(self) -> str:
+        """ Export the metrics in the Prometheus text format """
+        lines = []
+        with self.lock:
+            for name, metric in self.metrics.items():
+                lines.append('# HELP {name} {help}'.format(name=name, help=metric['help']))
+                lines.append('# TYPE {name} {type}'.format(name=name, type=metric['type']))
+                for key, series in sorted(metric['series'].items()):
+                    if metric['type'] == 'counter':
+                        lines.append('{name}{labels} {value}'.format(name=name, labels=self._labels(key),
+                                                                     value=series))
+                        continue
+                    total = 0
+                    for bound, count in zip(list(metric['buckets']) + ['+Inf'], series['buckets']):
+                        total += count
+                        lines.append('{name}_bucket{labels} {total}'.format(
+                            name=name, labels=self._labels(key + (('le', bound),)), total=total))
+                    lines.append('{name}_sum{labels} {sum}'.format(name=name, labels=self._labels(key),
+                                                                   sum=series['sum']))
+                    lines.append('{name}_count{labels} {total}'.format(name=name, labels=self._labels(key),
+                                                                       total=total))
+
+        # Statistics of the caches, read when the metrics are scraped
+        stats = {cache_name: cache.stats() for cache_name, cache in sorted(self.caches.items())}
+        for name, metric_type, stat, help_text in self.cache_metrics if stats else ():
+            lines.append('# HELP {name} {help}'.format(name=name, help=help_text))
+            lines.append('# TYPE {name} {type}'.format(name=name, type=metric_type))
+            for cache_name, cache_stats in stats.items():
+                lines.append('{name}{labels} {value}'.format(name=name, labels=self._labels((('cache', cache_name),)),
+                                                             value=cache_stats[stat]))
+        return '\n'.join(lines) + '\n'
+
+    # Wrap a registered Dash callback, which returns its response as JSON, to record its time and size
+    def _timed_callback(self, callback):
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                response = callback(*args, **kwargs)
+                outcome = 'ok'
+                self.observe('dash_callback_response_bytes', len(response), callback=callback.__name__)
+                return response
+            except PreventUpdate:
+                outcome = 'prevented'
+                raise
+            finally:
+                self.observe('dash_callback_seconds', time.perf_counter() - start,
+                             callback=callback.__name__, outcome=outcome)
+        return wrapper
+
+    # Flask view serving the metrics
+    def _response(self):
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    # Format the labels of a series, e.g. {method="read",le="0.5"}
+    @staticmethod
+    def _labels(key: tuple) -> str:
+        if not key:
+            return ''
+        return '{' + ','.join('{name}="{value}"'.format(
+            name=name, value=str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in key) + '}'
@@ -0,0 +1,171 @@
+# Python module that keeps a summary collection of the outcomes per month in MongoDB for the dashboard trend charts.
+
+import threading
+
+import pandas as pd
+
+from animal_shelter import AnimalShelter
+
+
+class OutcomeRollups(object):
+    """ Materialized outcome counts per month, animal type, outcome type and age bucket """
+
+    # Summary collection, and the document of the versions collection recording the data version it was built at
+    collection_name = 'outcome_rollups'
+    version_id = 'outcome_rollups'
+
+    # Field holding the outcome date and time as text, e.g. "2017-05-14 12:01:00", whose first 7 characters
+    # are the month
+    date_field = 'datetime'
+
+    # Fields the outcomes are counted by, besides the month and age bucket
+    rollup_fields = ['animal_type', 'outcome_type']
+
+    # Age buckets as (upper bound in weeks, label), animals of the last bound or older are in the oldest bucket
+    age_field = 'age_upon_outcome_in_weeks'
+    age_buckets = [(52, 'Under 1 year'), (156, '1 to 3 years'), (364, '3 to 7 years')]
+    oldest_bucket = '7 years and over'
+    unknown_bucket = 'Unknown age'
+
+    # Initialize OutcomeRollups object
+    # Input -> AnimalShelter used to build the rollups, seconds between checks for writes made by other processes,
+    #          and whether to keep the rollups current in a background thread. Writes made through the shelter
+    #          refresh the rollups right away.
+    def __init__(self, shelter: AnimalShelter, poll_interval: float = 5.0, follow: bool = True) -> None:
+        self.shelter = shelter
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()          # one refresh at a time
+        self.written = threading.Event()      # set by writes through the shelter
+        self.stopped = threading.Event()
+        self.data_version = 0                 # AnimalShelter data version the rollups were refreshed at
+        self.refresh()
+        shelter.add_listener(self.on_write)
+
+        # Follow writes to the collection in the background
+        self.thread = None
+        if follow:
+            self.thread = threading.Thread(target=self._follow, name='outcome-rollups', daemon=True)
+            self.thread.start()
+
+    # Summary collection in MongoDB
+    @property
+    def collection(self):
+        return self.shelter.database[self.collection_name]
+
+    # Refresh method recounts only the months of the animals written since the last refresh, merging their
+    # counts into the summary collection, or recounts every month when full is set or the rollups are new.
+    # Return -> number of months recounted, None when every month was recounted.
+    def refresh(self, full: bool = False) -> int:
+        """ Bring the outcome rollups up to date with the Animal collection """
+        with self.lock:
+            data_version = self.shelter.version()                       # read the version first so no write is missed
+            found = self.shelter.database.versions.find_one({'_id': self.version_id})
+            if found is None:
+                full = True
+            elif data_version == found['version'] and not full:
+                self.data_version = data_version
+                return 0
+
+            # Find the months of the animals written since the last refresh
+            months = None
+            if not full:
+                changed = self.shelter.aggregate([{'$match': {'_version': {'$gt': found['version']}}},
+                                                  {'$group': {'_id': self._month()}}])
+                months = sorted(group['_id'] for group in changed if group['_id'])
+            self._merge(months, data_version)
+
+            # Deleted animals and animals moved to another month leave their old month too high, so recount
+            # every month when the rollups no longer add up to the number of animals
+            total = next(iter(self.collection.aggregate([{'$group': {'_id': None, 'count': {'$sum': '$count'}}}])),
+                         {'count': 0})['count']
+            if months is not None and total != self.shelter.count({self.date_field: {'$gt': ''}}):
+                months = None
+                self._merge(months, data_version)
+
+            self.shelter.database.versions.update_one({'_id': self.version_id},
+                                                      {'$set': {'version': data_version}}, upsert=True)
+            self.data_version = data_version
+            return len(months) if months is not None else None
+
+    # Write listener wakes the background thread, which refreshes once for a burst of writes
+    def on_write(self, operation: str, data: dict) -> None:
+        """ Refresh the outcome rollups after a write to the Animal collection """
+        self.written.set()
+
+    # Summary method reads the counts of the rollups, never the Animal collection.
+    # Input -> fields to count by, from 'month', 'age_bucket' and rollup_fields, and the values to select,
+    #          e.g. summary(['month', 'animal_type'], outcome_type='Adoption'); empty values select every value.
+    # Return -> DataFrame with a column for each field and the count of outcomes, sorted by the fields.
+    def summary(self, by: list, **selected) -> pd.DataFrame:
+        """ Count the outcomes by month, age bucket, animal type or outcome type """
+        match = {'_id.' + field: value for field, value in selected.items() if value}
+        groups = self.collection.aggregate([{'$match': match},
+                                            {'$group': {'_id': {field: '$_id.' + field for field in by},
+                                                        'count': {'$sum': '$count'}}}])
+        frame = pd.DataFrame([dict(group['_id'], count=group['count']) for group in groups],
+                             columns=list(by) + ['count'])
+        return frame.sort_values(list(by), ignore_index=True)
+
+    # Stop following writes to the collection
+    def stop(self) -> None:
+        """ Stop the background thread that keeps the rollups current """
+        self.stopped.set()
+        self.written.set()
+
+    # Count the outcomes of some months, or of every month, and merge the counts into the summary collection.
+    # Counts of groups that no longer have any animal are left with an older version and removed afterwards.
+    def _merge(self, months: list, data_version: int) -> None:
+        if months is not None and not months:
+            return
+        if months is None:
+            match = {self.date_field: {'$gt': ''}}                      # every animal with an outcome date
+        else:
+            match = {'$or': [{self.date_field: {'$gte': month, '$lt': self._next_month(month)}} for month in months]}
+        pipeline = [{'$match': match},
+                    {'$group': {'_id': dict({'month': self._month(), 'age_bucket': self._age_bucket()},
+                                            **{field: '$' + field for field in self.rollup_fields}),
+                                'count': {'$sum': 1}}},
+                    {'$set': {'version': data_version}}]
+        try:
+            self.shelter.aggregate(pipeline + [{'$merge': {'into': self.collection_name,
+                                                           'whenMatched': 'replace',
+                                                           'whenNotMatched': 'insert'}}])
+        except NotImplementedError:                                      # test stand-ins without $merge
+            groups = list(self.shelter.aggregate(pipeline))
+            self.collection.delete_many({} if months is None else {'_id.month': {'$in': months}})
+            if groups:
+                self.collection.insert_many(groups)
+        stale = {'version': {'$lt': data_version}}
+        if months is not None:
+            stale['_id.month'] = {'$in': months}
+        self.collection.delete_many(stale)
+
+    # Aggregation expression of the month of an outcome, e.g. "2017-05"
+    def _month(self) -> dict:
+        return {'$substr': ['$' + self.date_field, 0, 7]}
+
+    # Aggregation expression of the age bucket of an animal
+    def _age_bucket(self) -> dict:
+        age = '$' + self.age_field
+        return {'$switch': {'branches': [{'case': {'$lte': [age, None]}, 'then': self.unknown_bucket}] +
+                                        [{'case': {'$lt': [age, bound]}, 'then': label}
+                                         for bound, label in self.age_buckets],
+                            'default': self.oldest_bucket}}
+
+    # First day of the month after a month, e.g. "2017-06" after "2017-05", for range queries on the outcome date
+    @staticmethod
+    def _next_month(month: str) -> str:
+        year, number = int(month[:4]), int(month[5:7])
+        return '{:04d}-{:02d}'.format(year + number // 12, number % 12 + 1)
+
+    # Refresh after writes through the shelter, and poll the data version for writes made by other processes
+    def _follow(self) -> None:
+        while not self.stopped.is_set():
+            self.written.wait(self.poll_interval)
+            self.written.clear()
+            if self.stopped.is_set():
+                return
+            try:
+                self.refresh()
+            except Exception as e:                                       # keep following if the database is unavailable
+                print("An exception occurred ::", e)
@@ -0,0 +1,35 @@
+# Python module that encodes DataFrames compactly for the browser, where assets/payload.js decodes them.
+
+import pandas as pd
+
+# Text columns with at most this many distinct values per row are sent dictionary encoded
+dictionary_share = 0.5
+
+
+# Encode a DataFrame by column instead of by row, so each column name is sent once, and dictionary encode text
+# columns with repeated values, so each distinct value is sent once with a small integer code per row.
+# Input -> DataFrame and the columns to send, by default all of them.
+# Return -> {'length': number of rows, 'columns': {name: list of values, or {'categories': list of distinct
+#           values, 'codes': list of indexes into the categories, -1 for missing values}}}
+def encode_frame(frame, columns=None):
+    encoded = {}
+    for column in frame.columns if columns is None else columns:
+        values = frame[column] if column in frame.columns else pd.Series([None] * len(frame), dtype=object)
+        if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+            codes, categories = pd.factorize(values)
+            if len(categories) <= dictionary_share * len(values):
+                encoded[column] = {'categories': categories.tolist(), 'codes': codes.tolist()}
+                continue
+        encoded[column] = values.tolist()
+    return {'length': len(frame), 'columns': encoded}
+
+
+# Decode a payload from encode_frame into a list of records, the way the browser does, e.g. to check a payload.
+# Return -> list of dictionaries, one per row, like DataFrame.to_dict('records').
+def decode_records(payload):
+    columns = {}
+    for column, values in payload['columns'].items():
+        if isinstance(values, dict):
+            values = [values['categories'][code] if code >= 0 else None for code in values['codes']]
+        columns[column] = values
+    return [{column: values[row] for column, values in columns.items()} for row in range(payload['length'])]
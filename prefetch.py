@@ -0,0 +1,138 @@
+# Python module that warms the results of the dashboard selections users make most often, in the background.
+
+import json
+import os
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher(object):
+    """ Background warm-up of the results of the most frequent selections """
+
+    # Initialize Prefetcher object
+    # Input -> function called with a selection to compute and cache its result, the most selections warmed in a round,
+    #          the number of threads warming them, the most distinct selections remembered, and an optional JSON file
+    #          the recorded selections are loaded from and saved to, so a restarted server warms them too.
+    def __init__(self, warm, budget: int = 16, workers: int = 2, history_size: int = 1000, path: str = None) -> None:
+        self.warm = warm
+        self.budget = budget
+        self.workers = workers
+        self.history_size = history_size
+        self.path = path
+        self.counts = Counter()               # selection as JSON -> times it was made
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if path and os.path.exists(path):
+            self.load(path)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    # Record method counts a selection made by a user.
+    # Input -> selection, a list of values such as the inputs of a callback, that can be converted to JSON.
+    def record(self, selection: list) -> None:
+        """ Count a selection made by a user """
+        key = self._key(selection)
+        with self.lock:
+            self.counts[key] += 1
+
+            # Forget the rarest selections, and halve the counts so recent selections weigh more
+            if len(self.counts) > self.history_size:
+                self.counts = Counter({key: (count + 1) // 2
+                                       for key, count in self.counts.most_common(self.history_size // 2)})
+
+    # Likely method to choose the selections to warm.
+    # Input -> selections to warm when too few have been recorded, most likely first.
+    # Return -> list of at most budget selections, the most frequent recorded selections first.
+    def likely(self, seeds: list = ()) -> list:
+        """ Get the selections most likely to be made next """
+        with self.lock:
+            keys = [key for key, count in self.counts.most_common(self.budget)]
+        for seed in seeds:
+            if len(keys) >= self.budget:
+                break
+            key = self._key(seed)
+            if key not in keys:
+                keys.append(key)
+        return [json.loads(key) for key in keys]
+
+    # Warm up method computes the results of the likely selections with a pool of threads.
+    # Input -> selections to warm when too few have been recorded.
+    # Return -> dictionary with the number of selections warmed, the number that failed and the seconds taken.
+    def warm_up(self, seeds: list = ()) -> dict:
+        """ Warm the results of the most likely selections """
+        start = time.perf_counter()
+        selections = self.likely(seeds)
+        errors = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch') as pool:
+            for future in [pool.submit(self.warm, selection) for selection in selections]:
+                try:
+                    future.result()
+                except Exception as e:                                   # warm the other selections
+                    print("An exception occurred ::", e)
+                    errors += 1
+        return {'warmed': len(selections) - errors, 'errors': errors, 'seconds': time.perf_counter() - start}
+
+    # Start method warms the likely selections now and again whenever the data changes, and every interval seconds
+    # so results are warmed again before they expire.
+    # Input -> functions returning the current data version and the seeds, seconds between checks of the
+    #          data version, and seconds between rounds while the data does not change.
+    def start(self, version, seeds=None, poll_interval: float = 5.0, interval: float = 120.0) -> None:
+        """ Start warming results in a background thread """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._follow, args=(version, seeds, poll_interval, interval),
+                                       name='prefetch', daemon=True)
+        self.thread.start()
+
+    # Stop method ends the background warm-up after the current round, saving the recorded selections
+    def stop(self) -> None:
+        """ Stop warming results in the background """
+        self.stopped.set()
+        if self.path:
+            self.save(self.path)
+
+    # Save method writes the recorded selections to a JSON file
+    def save(self, path: str) -> None:
+        """ Save the recorded selections """
+        with self.lock:
+            counts = dict(self.counts)
+        with open(path, 'w') as file:
+            json.dump(counts, file)
+
+    # Load method reads recorded selections saved by save, adding them to the ones recorded so far
+    def load(self, path: str) -> None:
+        """ Load recorded selections """
+        with open(path) as file:
+            counts = json.load(file)
+        with self.lock:
+            self.counts.update(counts)
+
+    # Warm a round whenever the data version changes or the interval has passed, saving the recorded selections
+    def _follow(self, version, seeds, poll_interval: float, interval: float) -> None:
+        warmed_version, warmed_time = None, None
+        while not self.stopped.is_set():
+            try:
+                current = version()
+                if current != warmed_version or time.monotonic() - warmed_time >= interval:
+                    report = self.warm_up(seeds() if seeds else ())
+                    warmed_version, warmed_time = current, time.monotonic()
+                    print("Warmed {warmed} results in {seconds:.2f} s, {errors} errors".format(**report))
+                    if self.path:
+                        self.save(self.path)
+            except Exception as e:                                       # keep warming if the database is unavailable
+                print("An exception occurred ::", e)
+            self.stopped.wait(poll_interval)
+
+    # Key of a selection, treating empty values ("" and None) the same
+    @staticmethod
+    def _key(selection: list) -> str:
+        return json.dumps([None if value == '' else value for value in selection], sort_keys=True)
+
+    # Forget the background thread and locks of the parent process in a forked worker
+    def _after_fork(self) -> None:
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
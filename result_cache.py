@@ -0,0 +1,156 @@
+# Python module that caches dashboard callback results in memory and, optionally, in a shared disk store.
+
+import functools
+import json
+import threading
+import time
+
+from collections import OrderedDict
+
+try:
+    import diskcache                      # optional shared store for several server processes
+except ImportError:
+    diskcache = None
+
+
+class ResultCache(object):
+    """ Bounded cache of callback results with least-recently-used eviction and expiry """
+
+    # Initialize ResultCache object
+    # Input -> most results kept in memory, seconds before a result expires (0 never expires), and an optional
+    #          directory for a diskcache store shared by every process using the same directory.
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0, directory: str = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()          # key -> (expiry time, result), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Use the shared store when a directory is given
+        self.shared = None
+        if directory is not None:
+            if diskcache is None:
+                raise Exception("Result cache error: the diskcache package is needed for a shared directory")
+            self.shared = diskcache.Cache(directory)
+
+    # Get method to look up a result.
+    # Input -> key of the result.
+    # Return -> (True, result) if the result is cached and has not expired, else (False, None).
+    def get(self, key: str) -> tuple:
+        """ Look up a cached result """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if not expires or expires > time.monotonic():
+                    self.entries.move_to_end(key)                        # mark as most recently used
+                    self.hits += 1
+                    return True, result
+                del self.entries[key]                                    # expired
+
+        # Fall back to the shared store, keeping a local copy for the next lookup
+        if self.shared is not None:
+            missing = object()
+            result = self.shared.get(key, default=missing)
+            if result is not missing:
+                self._store(key, result)
+                with self.lock:
+                    self.shared_hits += 1
+                return True, result
+
+        with self.lock:
+            self.misses += 1
+        return False, None
+
+    # Peek method to look up a result in memory without marking it as used or counting the lookup.
+    # Input -> key of the result.
+    # Return -> (True, result) if the result is cached in memory and has not expired, else (False, None).
+    def peek(self, key: str) -> tuple:
+        """ Look up a cached result without using it """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and (not entry[0] or entry[0] > time.monotonic()):
+            return True, entry[1]
+        return False, None
+
+    # Touch method to extend the expiry of a result in memory, and in the shared store, without marking it as used.
+    # Input -> key of the result, and optional seconds: the expiry is only extended if the result expires within them.
+    # Return -> True if the result is cached in memory and has not expired, else False.
+    def touch(self, key: str, within: float = None) -> bool:
+        """ Extend the expiry of a cached result """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[0] and entry[0] <= now):
+                return False
+            if not entry[0] or (within is not None and entry[0] - now > within):
+                return True
+            self.entries[key] = (now + self.ttl, entry[1])               # keeps its place in the LRU order
+        if self.shared is not None:
+            self.shared.touch(key, expire=self.ttl)
+        return True
+
+    # Set method to cache a result.
+    # Input -> key of the result, the result, and whether it is kept as the most recently used result, or as the
+    #          least recently used one so it is evicted first unless it is looked up, e.g. for results computed ahead.
+    def set(self, key: str, result, recent: bool = True) -> None:
+        """ Cache a result """
+        self._store(key, result, recent)
+        if self.shared is not None:
+            self.shared.set(key, result, expire=self.ttl or None)
+
+    # Clear method to remove every cached result
+    def clear(self) -> None:
+        """ Remove every cached result """
+        with self.lock:
+            self.entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    # Stats method reporting how well the cache works.
+    # Return -> dictionary with the number of hits (in memory and shared), misses, evictions and cached results.
+    def stats(self) -> dict:
+        """ Get the cache hit and miss counts """
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {'hits': self.hits,
+                    'shared_hits': self.shared_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'entries': len(self.entries)}
+
+    # Memoize decorator caching the results of a function by its arguments.
+    # Input -> optional function returning the current data version, so results of older data are not used.
+    # Return -> decorator for functions whose arguments can be converted to JSON.
+    def memoize(self, version=None):
+        """ Cache the results of a function by its arguments and the data version """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args):
+                key = self.key(function.__qualname__, args, version() if version else None)
+                found, result = self.get(key)
+                if not found:
+                    result = function(*args)
+                    self.set(key, result)
+                return result
+            return wrapper
+        return decorator
+
+    # Key for a function call, treating empty selections ("" and None) and lists and tuples the same
+    @staticmethod
+    def key(name: str, args: tuple, version=None) -> str:
+        normalized = [None if arg == '' else arg for arg in args]
+        return json.dumps([name, version, normalized], sort_keys=True, default=str)
+
+    # Store a result in memory, evicting the least recently used results when full
+    def _store(self, key: str, result, recent: bool = True) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl if self.ttl else 0, result)
+            self.entries.move_to_end(key, last=recent)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
@@ -0,0 +1,102 @@
+# Tests checking that queries on the in-memory AnimalCache match the same queries run by MongoDB through
+# AnimalShelter, using a mongomock client in place of a server.
+# Usage: python -m pytest tests
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from animal_cache import AnimalCache                 # noqa: E402
+from animal_shelter import AnimalShelter, AnimalQuery  # noqa: E402
+
+mongomock = pytest.importorskip('mongomock')
+
+# Animals with missing and null text values, and a number stored in a text field
+animals = [
+    {'animal_id': 'A1', 'animal_type': 'Dog', 'breed': 'Labrador Retriever Mix', 'color': 'Black',
+     'age_upon_outcome': '2 years', 'age_upon_outcome_in_weeks': 104.5, 'outcome_type': 'Adoption',
+     'name': 'Rex', 'datetime': '2015-03-01 10:00:00'},
+    {'animal_id': 'A2', 'animal_type': 'Dog', 'breed': 'Pit Bull Mix', 'color': 'Black/White',
+     'age_upon_outcome': 2, 'age_upon_outcome_in_weeks': 25.0, 'outcome_type': 'Transfer',
+     'name': 'Sam', 'datetime': '2016-07-12 09:30:00'},
+    {'animal_id': 'A3', 'animal_type': 'Cat', 'breed': None, 'color': 'Brown Tabby',
+     'age_upon_outcome': '5 months', 'age_upon_outcome_in_weeks': 21.0, 'outcome_type': 'Adoption',
+     'datetime': '2015-11-20 15:45:00'},
+    {'animal_id': 'A4', 'animal_type': 'Cat', 'color': 'Black',
+     'age_upon_outcome': '12 years', 'age_upon_outcome_in_weeks': 625.0, 'outcome_type': 'Euthanasia',
+     'name': 'Tom', 'datetime': '2017-01-05 12:00:00'},
+    {'animal_id': 'A5', 'animal_type': 'Bird', 'breed': 'Chicken', 'color': 'White',
+     'age_upon_outcome': '1 year', 'age_upon_outcome_in_weeks': 52.0, 'outcome_type': None,
+     'name': 'Hen', 'datetime': '2015-03-02 08:15:00'},
+]
+
+# Queries run through both AnimalCache.select and AnimalShelter.read
+queries = [
+    {'breed': {'$regex': 'mix', '$options': 'i'}},
+    {'age_upon_outcome_in_weeks': {'$regex': '5'}},                # numbers never match a regular expression
+    {'age_upon_outcome': {'$regex': '2'}},                         # nor do numbers in a text field
+    {'datetime': {'$regex': '^2015'}},
+    {'breed': None},
+    {'breed': {'$ne': None}},
+    {'breed': {'$gte': 'L'}},
+    {'outcome_type': {'$lt': 'F'}},
+    {'animal_type': 'Dog', 'age_upon_outcome_in_weeks': {'$gte': 20, '$lte': 110}},
+    {'$and': [{'color': {'$regex': '^Black'}}, {'outcome_type': {'$in': ['Adoption', 'Transfer']}}]},
+    AnimalQuery().where('animal_type', 'Cat').match({'color': {'$regex': 'tabby', '$options': 'i'}}),
+]
+
+
+@pytest.fixture
+def shelter():
+    shelter = AnimalShelter(client=mongomock.MongoClient())
+    shelter.create_many([dict(animal) for animal in animals])
+    return shelter
+
+
+@pytest.fixture
+def cache(shelter):
+    return AnimalCache(shelter, follow=False)
+
+
+@pytest.mark.parametrize('query', queries, ids=[str(query) for query in queries])
+def test_select_matches_read(shelter, cache, query):
+    expected = sorted(animal['animal_id'] for animal in shelter.read(query))
+    assert sorted(cache.select(query)['animal_id']) == expected
+
+
+def test_missing_categories_stay_missing(cache):
+    breeds = cache.frame.set_index('animal_id')['breed']
+    assert isinstance(breeds.dtype, pd.CategoricalDtype)
+    assert breeds[['A3', 'A4']].isna().all()
+    assert 'None' not in breeds.cat.categories
+    assert AnimalCache.value_counts(cache.frame, 'breed') == [(None, 2), ('Chicken', 1), ('Labrador Retriever Mix', 1),
+                                                              ('Pit Bull Mix', 1)]
+
+
+@pytest.mark.parametrize('field', ['breed', 'outcome_type', 'animal_type', 'missing_field'])
+@pytest.mark.parametrize('query', [{}, {'animal_type': 'Cat'}, {'animal_type': 'Fish'}])
+def test_value_counts_match_mongodb(shelter, cache, query, field):
+    assert AnimalCache.value_counts(cache.select(query), field) == shelter.value_counts(query, field)
+
+
+def test_snapshot_saved_after_catching_up(shelter, tmp_path):
+    path = str(tmp_path / 'animals.pkl')
+    AnimalCache(shelter, follow=False, snapshot=path).stop()
+    shelter.create({'animal_id': 'A6', 'animal_type': 'Dog'})
+    shelter.delete({'animal_id': 'A1'})
+
+    # A start after writes catches up from the snapshot and saves the result, so the next start reads nothing
+    cache = AnimalCache(shelter, follow=False, snapshot=path)
+    assert sorted(cache.frame['animal_id']) == ['A2', 'A3', 'A4', 'A5', 'A6']
+    saved = pd.read_pickle(path)
+    assert saved['data_version'] == shelter.version()
+    assert sorted(saved['frame']['animal_id']) == ['A2', 'A3', 'A4', 'A5', 'A6']
+
+    # Changes applied while following are saved when the cache stops
+    shelter.create({'animal_id': 'A7', 'animal_type': 'Cat'})
+    cache.catch_up()
+    cache.stop()
+    assert 'A7' in set(pd.read_pickle(path)['frame']['animal_id'])
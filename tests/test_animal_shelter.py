@@ -0,0 +1,75 @@
+# Tests of the AnimalShelter file import, using a mongomock client in place of a server.
+# Usage: python -m pytest tests
+
+import datetime
+import io
+import json
+import os
+import sys
+
+import pytest
+
+from bson.objectid import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from animal_shelter import AnimalShelter             # noqa: E402
+
+mongomock = pytest.importorskip('mongomock')
+
+animals = [{'animal_id': 'A{}'.format(number), 'animal_type': 'Dog', 'name': 'Rex, [{}]'.format(number),
+            'age_upon_outcome_in_weeks': number * 1.5} for number in range(25)]
+
+
+@pytest.fixture
+def shelter():
+    return AnimalShelter(client=mongomock.MongoClient())
+
+
+@pytest.mark.parametrize('name, text', [
+    ('animals.json', json.dumps(animals, indent=2)),
+    ('animals.json', '\n'.join(json.dumps(animal) for animal in animals)),
+    ('animals.jsonl', '\n'.join(json.dumps(animal) for animal in animals) + '\n\n'),
+    ('animals.ndjson', '  ' + json.dumps(animals)),
+])
+def test_import_file_reads_arrays_and_lines(shelter, tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    summary = shelter.import_file(str(path), batch_size=10)
+    assert summary['inserted'] == len(animals)
+    assert sorted(shelter.read({}), key=lambda animal: animal['age_upon_outcome_in_weeks']) == animals
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024])
+def test_json_array_documents_span_chunks(chunk_size):
+    file = io.StringIO(json.dumps(animals, indent=1))
+    assert list(AnimalShelter._json_documents(file, chunk_size)) == animals
+
+
+def test_truncated_json_array_fails():
+    file = io.StringIO(json.dumps(animals)[:-20])
+    with pytest.raises(json.JSONDecodeError):
+        list(AnimalShelter._json_documents(file, 64))
+
+
+def test_read_frame_unites_numeric_and_text_categories(shelter):
+    shelter.create_many([{'animal_id': 'A{}'.format(number), 'breed': breed}
+                         for number, breed in enumerate([None, None, 'X', 'X', 5, 5, None, 'X'])])
+    frame = shelter.read_frame({}, categories=['breed'], memory_limit=200)
+    assert frame['breed'].dtype == 'category'
+    assert frame['breed'].tolist()[2:6] == ['X', 'X', 5, 5]
+    assert frame['breed'].isna().sum() == 3
+
+
+@pytest.mark.parametrize('name, text', [
+    ('export.json', '{"_id":{"$oid":"5f1d7a4b2c3e4f5a6b7c8d9e"},"animal_id":"A1",'
+                    '"outcome_date":{"$date":"2015-03-01T10:00:00Z"}}\n'),
+    ('export.json', '[{"_id":{"$oid":"5f1d7a4b2c3e4f5a6b7c8d9e"},"animal_id":"A1",'
+                    '"outcome_date":{"$date":"2015-03-01T10:00:00Z"}}]'),
+])
+def test_import_file_decodes_mongoexport(shelter, tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    assert shelter.import_file(str(path))['inserted'] == 1
+    animal = shelter.database.animals.find_one({'animal_id': 'A1'})
+    assert animal['_id'] == ObjectId('5f1d7a4b2c3e4f5a6b7c8d9e')
+    assert animal['outcome_date'].replace(tzinfo=None) == datetime.datetime(2015, 3, 1, 10)
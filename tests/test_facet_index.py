@@ -0,0 +1,68 @@
+# Tests of the FacetIndex kept current with the writes to the animals collection, using a mongomock client.
+# Usage: python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from animal_shelter import AnimalShelter             # noqa: E402
+from facet_index import FacetIndex                   # noqa: E402
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def client():
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def shelter(client):
+    shelter = AnimalShelter(client=client)
+    shelter.create_many([{'animal_type': 'Dog', 'breed': 'Pit Bull Mix', 'sex_upon_outcome': 'Intact Male',
+                          'age_upon_outcome_in_weeks': 20.0},
+                         {'animal_type': 'Cat', 'breed': 'Siamese Mix', 'sex_upon_outcome': 'Spayed Female',
+                          'age_upon_outcome_in_weeks': 60.0}])
+    return shelter
+
+
+@pytest.fixture
+def facets(shelter):
+    return FacetIndex(shelter, follow=False)
+
+
+def test_inserts_are_added_in_place(shelter, facets, monkeypatch):
+    monkeypatch.setattr(facets, 'rebuild', lambda: pytest.fail("rebuilt after an insert"))
+    shelter.create({'animal_type': 'Dog', 'breed': 'Beagle', 'sex_upon_outcome': 'Intact Male',
+                    'age_upon_outcome_in_weeks': 5.0})
+    shelter.create_many([{'animal_type': 'Dog', 'breed': 'Beagle', 'age_upon_outcome_in_weeks': 90.0}] * 3)
+    assert facets.data_version == shelter.version()
+    assert not facets.dirty.is_set()
+    facets.catch_up()
+
+    options = facets.options('Dog')
+    assert options['counts']['breed'] == {'Pit Bull Mix': 1, 'Beagle': 4}
+    assert (options['age_min'], options['age_max']) == (5.0, 90.0)
+
+
+def test_other_writes_rebuild_once_when_caught_up(shelter, facets):
+    shelter.update({'animal_type': 'Cat'}, {'$set': {'breed': 'Persian'}})
+    shelter.delete({'animal_type': 'Dog'})
+    assert facets.dirty.is_set()
+    assert facets.options()['counts']['breed'] == {'Pit Bull Mix': 1, 'Siamese Mix': 1}
+
+    facets.catch_up()
+    assert facets.options()['counts']['breed'] == {'Persian': 1}
+    assert facets.data_version == shelter.version()
+    assert not facets.dirty.is_set()
+
+
+def test_writes_made_elsewhere_are_not_added_in_place(client, shelter, facets):
+    AnimalShelter(client=client).create({'animal_type': 'Bird', 'breed': 'Chicken'})
+    shelter.create({'animal_type': 'Dog', 'breed': 'Beagle'})
+    assert facets.dirty.is_set()
+
+    facets.catch_up()
+    assert facets.options()['counts']['animal_type'] == {'Dog': 2, 'Cat': 1, 'Bird': 1}
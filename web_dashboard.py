@@ -1,38 +1,401 @@
 import dash
 import dash_leaflet as dl
-import dash_leaflet.express as dlx
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.express as px
+import plotly.graph_objects as go
 import dash_table
 import dash_bootstrap_components as dbc
 import pandas as pd
+import atexit
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import weakref
+
+from pymongo import ASCENDING, DESCENDING
 
 from dash.exceptions import PreventUpdate
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from bson.objectid import ObjectId
 from animal_shelter import AnimalShelter # required module for MongoDB operations
+from animal_shelter import AnimalQuery   # builds the queries for AnimalShelter
+from async_shelter import AsyncAnimalShelter  # runs the MongoDB queries of one result at the same time
+from animal_cache import AnimalCache     # in-memory copy of the animals collection, also sorts and pages results
+from facet_index import FacetIndex       # menu options and age limits for each selection
+from outcome_rollups import OutcomeRollups  # outcome counts per month for the trend charts
+import map_layer                         # server-side clustering of the map markers
+import payload                           # compact table data, decoded in the browser by assets/payload.js
+from result_cache import ResultCache     # memoized callback results
+from prefetch import Prefetcher          # background warm-up of the most frequent selections
+from metrics import Metrics              # callback and query timings for the /metrics route
 
 
 # Data Manipulation / Model ############################################################################################
 
-# Username and password for needed to access animal shelter database
-username = "aacuser"
-password = "password"
-shelter = AnimalShelter(username, password)
+# Time the server started loading, to report the startup time
+start_time = time.perf_counter()
+
+# Username and password for needed to access animal shelter database, None to use the AAC_MONGO_USER and
+# AAC_MONGO_PASSWORD environment variables. The server address, pool size and timeouts are also set with
+# AAC_MONGO_* environment variables, see animal_shelter.connection_settings.
+username = None
+password = None
+
+# Print how MongoDB runs each dashboard query shape when the data is loaded, failing to load when one does not
+# use an index with tight bounds
+check_query_plans = False
+
+# Answer dashboard queries from an in-memory copy of the collection instead of MongoDB
+use_memory_cache = True
+
+# File the in-memory copy is saved to, so restarted servers only read the changes since it was saved.
+# It is saved again every few minutes while the copy changes and when the server exits.
+cache_snapshot = None
+
+# Start loading the data in the background when the server starts, instead of on the first request
+preload_data = True
+
+# Cache callback results by their inputs, for result_cache_ttl seconds, in memory and optionally
+# in a diskcache directory shared by every server process
+result_cache_size = 256
+result_cache_ttl = 300
+result_cache_directory = None
+results = ResultCache(result_cache_size, result_cache_ttl, result_cache_directory)
+
+# Show the number of matching animals next to each dropdown menu option
+show_option_counts = True
+
+# Show charts of the outcomes per month and of the outcomes by age, read from a summary collection
+# kept current with the writes instead of from the animals
+show_trend_charts = True
+
+# Send table and map data by column with repeated text sent once, decoded in the browser by assets/payload.js,
+# instead of one JSON object per row, and leave the styling of the default plotly template out of the pie chart
+compact_payloads = True
+
+# Compress responses with brotli or gzip when the browser accepts them
+compress_responses = True
+
+# Warm the filtered results of the selections users make most often in the background, when the data is loaded,
+# whenever it changes and before warmed results expire, so common first clicks are served from the result store.
+# Until selections are recorded, the most common animal types and breeds are warmed. prefetch_budget results
+# are warmed at most, by prefetch_workers threads. Warmed results are kept as recently used results, or with
+# prefetch_evict_first as the least recently used ones so they never evict results users asked for.
+# The recorded selections are saved to prefetch_history, if set, so a restarted server warms them too.
+# Results are warmed again every prefetch_interval seconds, which extends the expiry of the ones about to expire.
+prefetch_results = True
+prefetch_budget = 16
+prefetch_workers = 2
+prefetch_evict_first = False
+prefetch_history = None
+prefetch_interval = result_cache_ttl / 2
+
+# Record how long callbacks, dashboard steps and database methods take and how well the result caches work,
+# served on the /metrics route, and print database methods taking at least slow_query_seconds (None to print none)
+slow_query_seconds = 0.5
+metrics = Metrics(slow_query_seconds)
+metrics.add_cache('results', results)
+
+# Data used by the callbacks, set by load_data
+shelter = None
+cache = None
+facets = None
+rollups = None
+async_shelter = None
+table_fields = []
+data_lock = threading.Lock()
+
+
+# Connect to the database and load the dashboard data once, the first time it is needed
+def load_data():
+    global shelter, cache, facets, rollups, async_shelter, table_fields
+    if facets is not None:
+        return
+
+    with data_lock:
+        if facets is not None:                    # loaded while waiting for the lock
+            return
+        load_start = time.perf_counter()
+        connection = AnimalShelter(username, password)
+        connection.add_observer(metrics.observe_shelter)
+
+        # Create the indexes used by the dashboard queries if they do not exist yet
+        connection.ensure_indexes()
+        if check_query_plans:
+            for report in connection.explain_shapes():
+                print("{stage:8} {index}: examined {docs_examined} docs, returned {returned} in {ms} ms for {query}"
+                      .format(**report))
+
+        # Load the in-memory copy and get the table fields from it, or from the first animals in the database
+        if use_memory_cache:
+            cache = AnimalCache(connection, snapshot=cache_snapshot)
+            table_fields = cache.columns
+        else:
+            table_fields = list(pd.DataFrame.from_records(connection.read({}, limit=100)).columns)
+            async_shelter = AsyncAnimalShelter(connection)
+
+        # Bring the outcome rollups up to date for the trend charts
+        if show_trend_charts:
+            rollups = OutcomeRollups(connection)
+
+        # Index the animal type, breed and gender combinations for the dropdown menus
+        shelter = connection
+        facets = FacetIndex(connection)
+        print("Dashboard data loaded in {load:.2f} s, {total:.2f} s after the server started".format(
+            load=time.perf_counter() - load_start, total=time.perf_counter() - start_time))
+
+        # Warm the results of the most frequent selections in the background
+        if prefetch_results:
+            prefetcher.start(data_version, common_selections, interval=prefetch_interval)
+
+
+# Load the data again in a forked worker process, whose copy of the background threads is not running
+def reset_data():
+    global shelter, cache, facets, rollups, async_shelter, table_fields, data_lock
+    shelter, cache, facets, rollups, async_shelter, table_fields = None, None, None, None, None, []
+    data_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_data)
+
+
+# Save the in-memory copy when the server exits, so the next start reads fewer changes
+@atexit.register
+def stop_data():
+    if cache is not None:
+        cache.stop()
+
+
+# Version of the animal data, cached results of older data are not used
+def data_version():
+    load_data()
+    return cache.data_version if cache is not None else shelter.version()
+
+
+# Version of the facet index, cached menu options of an older index are not used
+def facets_version():
+    load_data()
+    return facets.data_version
+
+
+# Version of the outcome rollups, cached trend charts of older rollups are not used, None without trend charts
+def rollups_version():
+    load_data()
+    return rollups.data_version if rollups is not None else None
+
+
+# Create dropdown menu options from the number of animals with each value
+def menu_options(counts):
+    return [{'label': '{value} ({count})'.format(value=o, count=counts[o]) if show_option_counts else str(o),
+             'value': str(o)} for o in sorted(o for o in counts if o is not None)]
+
+
+# Age range slider limits of the animals matching a selection, from the facet index options
+def age_limits(options):
+    age_min = max(int(options['age_min']), 0)        # Ensure age_min is positive
+    age_max = max(int(options['age_max']), age_min)  # Ensure age_max is >= age_min
+    return age_min, age_max
+
+
+# Number of table rows requested from the database at a time
+table_page_size = 10
+
+# Map mode, either 'page' to show the animals in the current table page or
+# 'cluster' to show every matching animal, clustered on the server and limited to the visible part of the map
+map_mode = 'cluster'
+
+# Initial map position, the map is centered on the animals once they are loaded
+map_center = [30.35, -97.65]
+map_zoom = 9
+
+# Table filter operators in the order they must be matched (longer symbols first)
+# mapped to the equivalent MongoDB query operators
+filter_operators = [['ge ', '>=', '$gte'],
+                    ['le ', '<=', '$lte'],
+                    ['lt ', '<', '$lt'],
+                    ['gt ', '>', '$gt'],
+                    ['ne ', '!=', '$ne'],
+                    ['eq ', '=', '$eq'],
+                    ['contains ', '$regex'],
+                    ['datestartswith ', '$regex']]
+
+
+# Split one part of a table filter query, e.g. '{breed} contains "Lab"', into its column, operator and value
+def split_filter_part(filter_part):
+    for operator_type in filter_operators:
+        for operator in operator_type[:-1]:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                # Strip quotes from string values, otherwise try to interpret the value of a comparison as a number.
+                # Word operators like 'contains' and 'datestartswith' match text, so their value is kept as typed.
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                elif len(operator_type) == 2:
+                    value = value_part
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), operator_type[-1], value
+
+    return [None] * 4
+
+
+# Translate a table filter query into a MongoDB query
+def filter_query_to_mongo(filter_query):
+    query = {}
+    if not filter_query:
+        return query
+
+    for filter_part in filter_query.split(' && '):
+        name, operator, mongo_operator, value = split_filter_part(filter_part)
+        if name is None:
+            continue
+        if operator == 'contains':
+            condition = {'$regex': re.escape(str(value)), '$options': 'i'}   # case-insensitive substring match
+        elif operator == 'datestartswith':
+            condition = {'$regex': '^' + re.escape(str(value))}              # match dates by prefix
+        else:
+            condition = {mongo_operator: value}
+        query.setdefault(name, {}).update(condition)                         # combine conditions on the same column
+
+    return query
+
+
+# Build the query for the dropdown choices, the age range and any table filters typed into the column headers
+def build_query(genders_dropdown, types_dropdown, breeds_dropdown, age_range, filter_query):
+
+    # Define age range slider limits and prevent range settings where no animals appear
+    age_min = max(age_range[0], 0)                # Ensure age_min is positive
+    age_max = max(age_range[1] + 1, age_min + 1)  # Ensure age_max is 1 greater than age_min
+
+    return (AnimalQuery()
+            .where("sex_upon_outcome", genders_dropdown)
+            .where("animal_type", types_dropdown)
+            .where("breed", breeds_dropdown)
+            .between("age_upon_outcome_in_weeks", age_min, age_max)
+            .match(filter_query_to_mongo(filter_query)))
+
+
+# Read the animals matching a query, indexed by document id, and count their breeds. From the in-memory copy only
+# the positions of the animals in its snapshot are kept, with a weak reference so a replaced snapshot is freed.
+# From MongoDB the animals are kept, and the read and the breed count run at the same time.
+def read_result(query):
+    if cache is not None:
+        snapshot, rows = cache.locate(query)
+        dff = snapshot if rows is None else snapshot.iloc[rows]
+        return {'snapshot': weakref.ref(snapshot), 'rows': rows, 'breeds': AnimalCache.value_counts(dff, 'breed')}
+    dff, breeds = async_shelter.run(async_shelter.read_frame(query), async_shelter.value_counts(query, 'breed'))
+    return {'frame': dff.set_index('_id') if '_id' in dff.columns else dff, 'breeds': breeds}
+
+
+# Animals of a filtered result, sliced from the snapshot it was read from with the table fields.
+# Return -> DataFrame, or None when the snapshot has been replaced since.
+def result_frame(result):
+    if 'snapshot' not in result:
+        return result['frame']
+    snapshot = result['snapshot']()
+    if snapshot is None:
+        return None
+    dff = snapshot if result['rows'] is None else snapshot.iloc[result['rows']]
+    return dff if list(dff.columns) == table_fields else dff[[f for f in table_fields if f in dff.columns]]
+
+
+# Translate the table sort settings into a MongoDB sort specification
+def sort_by_to_mongo(sort_by):
+    return [(col['column_id'], ASCENDING if col['direction'] == 'asc' else DESCENDING) for col in sort_by or []]
+
+
+# Number of filtered results kept on the server for the table, pie chart and map, as the positions of the animals
+# in the in-memory snapshot or, without it, as the animals read from MongoDB
+result_store_size = 32
+result_store = ResultCache(result_store_size, result_cache_ttl)
+metrics.add_cache('result_store', result_store)
+
+
+# Read the animals matching the menu selections, age range and table filters once per interaction, keeping them on
+# the server so the table, pie chart and map all use the same result. The selections are saved in the
+# 'result-store' component with the result key, so a server process without the result can read it again.
+# Results read ahead of the users, by the prefetcher, are not marked as used.
+def filtered_result(selections, ahead=False):
+    load_data()
+    query = build_query(*selections).project('_id', *table_fields)
+    key = hashlib.sha1(ResultCache.key('result', (query.key(),), data_version()).encode()).hexdigest()
+    if ahead:
+        found, result = result_store.peek(key)
+        if found:
+            result_store.touch(key, prefetch_interval)                  # keep it until the next round
+    else:
+        found, result = result_store.get(key)
+    frame = result_frame(result) if found else None
+    if frame is None:
+        with metrics.timer('dashboard_step_seconds', step='read result'):
+            result = dict(read_result(query), key=key)
+        result_store.set(key, result, recent=not (ahead and prefetch_evict_first))
+        frame = result_frame(result)
+    return dict(result, frame=frame)
+
+
+# Read the result of a selection ahead of the users, see prefetch_results
+def warm_result(selections):
+    filtered_result(selections, ahead=True)
+
+
+# Selections of the whole collection, each animal type and the most common breeds, as update_dropdowns and
+# update_result make them, warmed until users have made enough selections
+def common_selections():
+    types = sorted(((animal_type, count) for animal_type, count in facets.options()['counts']['animal_type'].items()
+                    if animal_type is not None), key=lambda item: -item[1])
+    breeds = sorted(((count, animal_type, breed) for animal_type, type_count in types
+                     for breed, count in facets.options(animal_type)['counts']['breed'].items()
+                     if breed is not None), reverse=True)
+    choices = [('', '')] + [(animal_type, '') for animal_type, count in types] + \
+              [(animal_type, breed) for count, animal_type, breed in breeds]
+    return [['', str(animal_type), str(breed), list(age_limits(facets.options(animal_type, breed))), '']
+            for animal_type, breed in choices[:prefetch_budget]]
+
 
-# Create dataframe from MongoDB database
-df = pd.DataFrame.from_records(shelter.read({}))
+# Selections recorded by update_result and warmed in the background
+prefetcher = Prefetcher(warm_result, prefetch_budget, prefetch_workers, path=prefetch_history)
 
-# Get animal properties for dropdown menu options
-genders = list(sorted(df['sex_upon_outcome'].unique()))
-types = list(sorted(df['animal_type'].unique()))
-breeds = list(sorted(df['breed'].unique()))
-gender_options = [{'label': str(o), 'value': str(o)} for o in genders]
-type_options = [{'label': str(o), 'value': str(o)} for o in types]
-breed_options = [{'label': str(o), 'value': str(o)} for o in breeds]
 
-# Define age range slider limits
-age_range_max = int(df['age_upon_outcome_in_weeks'].max())
+# Sort and slice a filtered result for the current table page, or its last page when it has fewer pages
+def result_page(result, page_current, page_size, sort_by):
+    page_size = page_size or table_page_size
+    page_current = min(page_current or 0, max(math.ceil(len(result['frame']) / page_size) - 1, 0))
+    return AnimalCache.page(result['frame'], skip=page_current * page_size, limit=page_size,
+                            sort=sort_by_to_mongo(sort_by))
+
+
+# Pie chart scope, either 'page' for the breeds in the current table page or
+# 'result' for the breeds of every matching animal
+pie_chart_scope = 'result'
+
+# Number of breeds shown in the pie chart, the remaining breeds are grouped as "Other"
+pie_chart_top_n = 10
+
+# Plotly template of the pie chart. The default template adds about 7 KB of styling to every chart,
+# with compact payloads only the colors and margins it gives pie charts are sent.
+pie_chart_template = go.layout.Template(layout={'colorway': px.colors.qualitative.Plotly},
+                                        data={'pie': [{'automargin': True}]}) if compact_payloads else None
+
+# Plotly template of the trend charts, only the colors of the default template with compact payloads
+trend_chart_template = go.layout.Template(layout={'colorway': px.colors.qualitative.Plotly}) \
+    if compact_payloads else None
+
+# Outcome types compared in the outcomes by age chart, the remaining outcomes are grouped as "Other"
+trend_chart_outcomes = ['Adoption', 'Transfer', 'Return to Owner', 'Euthanasia']
 
 # Appearance settings
 pie_chart_text_color = 'white'
@@ -43,144 +406,197 @@ table_outline_color = '#000'
 
 # Dashboard ############################################################################################################
 
-# Start Dash application
-app = dash.Dash(__name__, prevent_initial_callbacks=True, external_stylesheets=[dbc.themes.DARKLY])
+# Define dashboard layout, an empty shell that the callbacks fill once the page is loaded
+def serve_layout():
+    return html.Div([
 
-# Define dashboard layout
-app.layout = html.Div([
+        # Title
+        html.Center(html.P(html.H2('Animal Shelter Dashboard'))),
 
-    # Title
-    html.Center(html.P(html.H2('Animal Shelter Dashboard'))),
-
-    # Controls
-    html.Div([
-
-        # Reset button to clear menu selections
+        # Controls
         html.Div([
-            html.Button('Reset', id='reset-button', n_clicks=0),
-        ], style={'width': '50px',
-                  'margin-top': '24px',
-                  'margin-left': '10px',
-                  'margin-right': '10px',
-                  'verticalAlign': 'top',
-                  'display': 'inline-block'}
-        ),
 
-        # Animal type dropdown
-        html.Label([
-            "Animal Type:",
-            dcc.Dropdown(
-                id="types-dropdown",
-                options=type_options,
-                placeholder="Select a type",
-                searchable=False,
-            )
-        ], style={'width': '15vw',
-                  'margin-left': '10px',
-                  'verticalAlign': 'top',
-                  'display': 'inline-block'}
-        ),
+            # Reset button to clear menu selections
+            html.Div([
+                html.Button('Reset', id='reset-button', n_clicks=0),
+            ], style={'width': '50px',
+                      'margin-top': '24px',
+                      'margin-left': '10px',
+                      'margin-right': '10px',
+                      'verticalAlign': 'top',
+                      'display': 'inline-block'}
+            ),
 
-        # Animal breed dropdown
-        html.Label([
-            "Animal Breed:",
-            dcc.Dropdown(
-                id="breeds-dropdown",
-                options=breed_options,
-                placeholder="Select a breed",
-            )
-        ], style={'width': '25vw',
-                  'margin-left': '10px',
-                  'verticalAlign': 'top',
-                  'display': 'inline-block'}
-        ),
+            # Animal type dropdown
+            html.Label([
+                "Animal Type:",
+                dcc.Dropdown(
+                    id="types-dropdown",
+                    options=[],                 # filled by update_dropdowns when the page loads
+                    placeholder="Select a type",
+                    searchable=False,
+                )
+            ], style={'width': '15vw',
+                      'margin-left': '10px',
+                      'verticalAlign': 'top',
+                      'display': 'inline-block'}
+            ),
 
-        # Animal gender dropdown
-        html.Label([
-            "Animal Gender:",
-            dcc.Dropdown(
-                id="genders-dropdown",
-                options=gender_options,
-                placeholder="Select a Gender",
-            )
-        ], style={'width': '15vw',
-                  'margin-left': '10px',
-                  'verticalAlign': 'top',
-                  'display': 'inline-block'}
-        ),
+            # Animal breed dropdown
+            html.Label([
+                "Animal Breed:",
+                dcc.Dropdown(
+                    id="breeds-dropdown",
+                    options=[],                 # filled by update_dropdowns when the page loads
+                    placeholder="Select a breed",
+                )
+            ], style={'width': '25vw',
+                      'margin-left': '10px',
+                      'verticalAlign': 'top',
+                      'display': 'inline-block'}
+            ),
 
-        # Animal age range slider
-        html.Div([
-            html.Center(id='slider-text',
-                        style={'margin-bottom': 10},
-                        children=['Age Range: 0 to {max_age} weeks'.format(max_age=int(age_range_max))]
-                        ),
-            dcc.RangeSlider(
-                id='age-range-slider',
-                min=0,
-                max=age_range_max,
-                value=[0, age_range_max],
-                step=1,
-                updatemode='mouseup',
-                allowCross=False,
+            # Animal gender dropdown
+            html.Label([
+                "Animal Gender:",
+                dcc.Dropdown(
+                    id="genders-dropdown",
+                    options=[],                 # filled by update_dropdowns when the page loads
+                    placeholder="Select a Gender",
+                )
+            ], style={'width': '15vw',
+                      'margin-left': '10px',
+                      'verticalAlign': 'top',
+                      'display': 'inline-block'}
             ),
-        ], style={'width': '30vw',
-                  'margin-left': '10px',
-                  'verticalAlign': 'top',
-                  'display': 'inline-block'}
+
+            # Animal age range slider
+            html.Div([
+                html.Center(id='slider-text',
+                            style={'margin-bottom': 10},
+                            children=['Age Range']
+                            ),
+                dcc.RangeSlider(
+                    id='age-range-slider',
+                    min=0,
+                    max=1,                                 # limits are set by update_dropdowns when the page loads
+                    value=[0, 1],
+                    step=1,
+                    updatemode='mouseup',
+                    allowCross=False,
+                ),
+            ], style={'width': '30vw',
+                      'margin-left': '10px',
+                      'verticalAlign': 'top',
+                      'display': 'inline-block'}
+            ),
+        ]),
+
+        # Key and selections of the filtered result kept on the server, see filtered_result
+        dcc.Store(id='result-store'),
+
+        # Compact table and map data decoded in the browser, see compact_payloads
+        dcc.Store(id='table-payload'),
+        dcc.Store(id='map-payload'),
+
+        # Data table
+        dash_table.DataTable(
+            id='datatable-id',
+            columns=[],                                # columns and data are set by update_dashboard
+            style_header={'backgroundColor': table_title_color},
+            style_cell={
+                'overflow': 'hidden',
+                'textOverflow': 'ellipsis',
+                'maxWidth': 0,                         # Adjust cell width so data fits on screen
+                'backgroundColor': table_background_color,
+                'border': '1px solid ' + table_outline_color
+            },
+            data=[],
+            editable=False,                            # Prevent column-level editing
+            filter_action="custom",                    # Table filters are translated to MongoDB queries
+            filter_query='',                           # Start with no table filter
+            sort_action="custom",                      # Columns are sorted on the server
+            sort_mode="multi",                         # Enable multi-column sorting
+            column_selectable=False,                   # Prevent columns from being selected
+            row_selectable="single",                   # Enable single-row selection
+            row_deletable=False,                       # Prevent rows from being deleted
+            selected_columns=[],                       # Indices of the selected columns in table
+            selected_rows=[],                          # Indices of the selected rows in table
+            page_action="custom",                      # Only the current page is sent to the browser
+            page_current=0,                            # Define start page
+            page_size=table_page_size,                 # Define number of rows per page
+            page_count=1,
+            style_table={'overflowY': 'auto', 'height': '365px'}
         ),
-    ]),
-
-    # Data table
-    dash_table.DataTable(
-        id='datatable-id',
-        columns=[{"name": i, "id": i, "deletable": False, "selectable": True} for i in df.columns],
-        style_header={'backgroundColor': table_title_color},
-        style_cell={
-            'overflow': 'hidden',
-            'textOverflow': 'ellipsis',
-            'maxWidth': 0,                         # Adjust cell width so data fits on screen
-            'backgroundColor': table_background_color,
-            'border': '1px solid ' + table_outline_color
-        },
-        data=df.to_dict('records'),
-        editable=False,                            # Prevent column-level editing
-        filter_action="native",                    # Enable UI filtering
-        sort_action="native",                      # Allow columns to be sorted
-        sort_mode="multi",                         # Enable multi-column sorting
-        column_selectable=False,                   # Prevent columns from being selected
-        row_selectable="single",                   # Enable single-row selection
-        row_deletable=False,                       # Prevent rows from being deleted
-        selected_columns=[],                       # Indices of the selected columns in table
-        selected_rows=[],                          # Indices of the selected rows in table
-        page_action="native",                      # Paging logic is handled by the table
-        page_current=0,                            # Define start page
-        page_size=10,                              # Define number of rows per page
-        style_table={'overflowY': 'auto', 'height': '365px'}
-    ),
-    html.Br(),
-    html.Hr(),
-
-    # Map and pie chart
-    html.Div(
-        style={'display': 'flex'},
-        children=[
-        html.Div(id="map-id", style={'display': 'inline-block'}),
-        html.Div(id="graph-id", style={'display': 'inline-block'})
-    ]),
-],
-    style={'margin': '10px'}  # Create border around page
-)
+        html.Br(),
+        html.Hr(),
+
+        # Map and pie chart
+        html.Div(
+            style={'display': 'flex'},
+            children=[
+            html.Div(id="map-id", style={'display': 'inline-block'}, children=[
+                dl.Map(id='animal-map',
+                       style={'width': '50vw', 'height': '480px'},  # make width 50% and height 45%
+                       center=map_center,
+                       zoom=map_zoom,                               # zoom level smaller=closer
+                       children=[
+                           dl.TileLayer(id="base-layer-id"),
+                           dl.GeoJSON(id='map-markers'),            # individual animals
+                           dl.LayerGroup(id='map-clusters'),        # groups of nearby animals in cluster mode
+                           dl.LayerGroup(id='map-popup')]           # details of the clicked animal in cluster mode
+                )
+            ]),
+            html.Div(id="graph-id", style={'display': 'inline-block'})
+        ]),
+
+        # Trend charts of the outcomes per month and by age
+        html.Div(id="trend-id", style={'display': 'flex'}),
+    ],
+        style={'margin': '10px'}  # Create border around page
+    )
+
+
+# Create the Dash application, rendering the layout for every page load
+def create_app():
+    dash_app = dash.Dash(__name__, prevent_initial_callbacks=True, external_stylesheets=[dbc.themes.DARKLY],
+                         compress=compress_responses)
+    dash_app.layout = serve_layout
+    return dash_app
+
+
+# Start Dash application
+app = create_app()
+server = app.server  # WSGI server for gunicorn, e.g. gunicorn web_dashboard:server
+
+
+# Health check for load balancers, with the database ping time and connection pool counters of this worker
+@server.route('/health')
+def health():
+    if shelter is None:
+        return {'ok': False, 'error': 'data not loaded yet', 'pid': os.getpid()}, 503
+    status = shelter.health()
+    return status, 200 if status['ok'] else 503
+
+
+# Load the data in the background while the server starts accepting requests
+if preload_data:
+    threading.Thread(target=load_data, name='load-data', daemon=True).start()
+print("Dashboard server started in {:.2f} s".format(time.perf_counter() - start_time))
 
 
 # Callbacks ############################################################################################################
 
-# Callback to update text above age range slider
+# Callback to update text above age range slider while it is dragged or when its range is set
 @app.callback(
     Output('slider-text', 'children'),
-    [Input('age-range-slider', 'drag_value')]
+    [Input('age-range-slider', 'drag_value'),
+     Input('age-range-slider', 'value')]
 )
-def update_output(value):
+def update_output(drag_value, value):
+    changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
+    if 'drag_value' in changed_id:
+        value = drag_value
     # Update text above age range slider to show min and max values
     return 'Age Range: {min_age} to {max_age} weeks'.format(min_age=value[0], max_age=value[1])
 
@@ -192,244 +608,354 @@ def update_output(value):
      Output('genders-dropdown', 'value')],
     [Input('reset-button', 'n_clicks')]
 )
-def update_dropdowns(reset):
+def reset_dropdowns(reset):
     changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
     # Clear menus selections when reset is clicked
     if 'reset-button' in changed_id:
         return "", "", ""
 
 
-# Callback to update the table when a menu selection is made
+# Callback to read the animals matching the selections when a menu selection is made or the table is filtered,
+# returning the table to its first page
 @app.callback(
-    [Output('datatable-id', 'data'),
-     Output('datatable-id', 'columns'),
-     Output('datatable-id', 'selected_rows')],
+    [Output('result-store', 'data'),
+     Output('datatable-id', 'page_current')],
     [Input('genders-dropdown', 'value'),
      Input('types-dropdown', 'value'),
      Input('breeds-dropdown', 'value'),
-     Input('age-range-slider', 'value')]
+     Input('age-range-slider', 'value'),
+     Input('datatable-id', 'filter_query')]
 )
-def update_dashboard(genders_dropdown, types_dropdown, breeds_dropdown, age_range):
+def update_result(genders_dropdown, types_dropdown, breeds_dropdown, age_range, filter_query):
+    selections = [genders_dropdown, types_dropdown, breeds_dropdown, age_range, filter_query]
+    prefetcher.record(selections)
+    return {'key': filtered_result(selections)['key'], 'selections': selections}, 0
 
-    # Define age range slider limits and prevent range settings where no animals appear
-    age_min = max(age_range[0], 0)                # Ensure age_min is positive
-    age_max = max(age_range[1] + 1, age_min + 1)  # Ensure age_max is 1 greater than age_min
-
-    # Conditional block that determines which query to execute based on dropdown choices
-    if genders_dropdown and types_dropdown and breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"sex_upon_outcome": genders_dropdown,
-                                                      "animal_type": types_dropdown,
-                                                      "breed": breeds_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
-
-    elif genders_dropdown and types_dropdown and not breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"sex_upon_outcome": genders_dropdown,
-                                                      "animal_type": types_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
 
-    elif genders_dropdown and not types_dropdown and breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"sex_upon_outcome": genders_dropdown,
-                                                      "breed": breeds_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
-
-    elif genders_dropdown and not types_dropdown and not breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"sex_upon_outcome": genders_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
+# Callback to update the table when the filtered result changes or the table is paged or sorted
+@app.callback(
+    [Output('table-payload' if compact_payloads else 'datatable-id', 'data'),
+     Output('datatable-id', 'columns'),
+     Output('datatable-id', 'selected_rows'),
+     Output('datatable-id', 'page_count')],
+    [Input('result-store', 'data'),
+     Input('datatable-id', 'page_current'),
+     Input('datatable-id', 'page_size'),
+     Input('datatable-id', 'sort_by')],
+    [State('datatable-id', 'selected_rows')]
+)
+def update_dashboard(result_store_data, page_current, page_size, sort_by, selected_rows):
+    if not result_store_data:
+        raise PreventUpdate
+    data, columns, page_count = table_page(result_store_data, page_current, page_size, sort_by)
+
+    # Clear the selected row when the result changes, or when paging or sorting moves it to another animal,
+    # and otherwise leave the selection and the map as they are
+    changed_ids = [p['prop_id'] for p in dash.callback_context.triggered]
+    if selected_rows or any('result-store' in changed_id for changed_id in changed_ids):
+        selected_rows = []
+    else:
+        selected_rows = dash.no_update
 
-    elif not genders_dropdown and types_dropdown and breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"animal_type": types_dropdown,
-                                                      "breed": breeds_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
+    # Return data, columns, selected rows and the number of pages
+    return data, columns, selected_rows, page_count
 
-    elif not genders_dropdown and types_dropdown and not breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"animal_type": types_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
 
-    elif not genders_dropdown and not types_dropdown and breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"breed": breeds_dropdown,
-                                                      "age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
+# Table data, columns and number of pages of a page of the filtered result
+@results.memoize(data_version)
+def table_page(result_store_data, page_current, page_size, sort_by):
 
-    elif not genders_dropdown and not types_dropdown and not breeds_dropdown:
-        dff = pd.DataFrame.from_records(shelter.read({"age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
+    # Sort and page the filtered result
+    result = filtered_result(result_store_data['selections'])
+    page_size = page_size or table_page_size
+    with metrics.timer('dashboard_step_seconds', step='table page'):
+        dff = result_page(result, page_current, page_size, sort_by)
 
-    # If the reset button is selected
-    else:
-        dff = pd.DataFrame.from_records(shelter.read(
-            {"age_upon_outcome_in_weeks": {"$gte": age_min, "$lte": age_max}}))
+    # Count all matches so the table can show the number of pages
+    page_count = max(math.ceil(len(result['frame']) / page_size), 1)
 
     # Table column labels
-    columns = [{"name": i, "id": i, "deletable": False, "selectable": True} for i in df.columns]
+    columns = [{"name": i, "id": i, "deletable": False, "selectable": True} for i in table_fields]
 
     # If there are no matches to selection, use empty data
     if dff.empty:
-        dff = pd.DataFrame(columns=df.columns)
+        dff = pd.DataFrame(columns=table_fields)
 
-    # Convert dataframe to dictionary to display in table
-    data = dff.to_dict('records')
+    # Convert dataframe to compact columns or to dictionary to display in table
+    with metrics.timer('dashboard_step_seconds', step='table records'):
+        data = payload.encode_frame(dff, table_fields) if compact_payloads else dff.to_dict('records')
 
-    # Return data, columns, clear selected rows, set page number to 0
-    return data, columns, []
+    return data, columns, page_count
 
 
-# Callback to update other dropdowns and slider when a selection is made
+# Callback to update other dropdowns and slider when a selection is made, and to fill them when the page loads
 @app.callback(
     [Output('types-dropdown', 'options'),
      Output('breeds-dropdown', 'options'),
      Output('genders-dropdown', 'options'),
      Output('age-range-slider', 'min'),
      Output('age-range-slider', 'max'),
-     Output('age-range-slider', 'value'),
-     Output('datatable-id', "page_current")],
+     Output('age-range-slider', 'value')],
     [Input('types-dropdown', 'value'),
      Input('breeds-dropdown', 'value'),
-     Input('genders-dropdown', 'value')]
+     Input('genders-dropdown', 'value')],
+    prevent_initial_call=False
 )
+@results.memoize(facets_version)
 def update_dropdowns(animal_type, animal_breed, animal_gender):
 
-    # Animal type selected
-    if animal_type and animal_breed and animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"animal_type": animal_type, "breed": animal_breed, "sex_upon_outcome": animal_gender}))
-    elif animal_type and animal_breed and not animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"animal_type": animal_type, "breed": animal_breed}))
-    elif animal_type and not animal_breed and animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"animal_type": animal_type, "sex_upon_outcome": animal_gender}))
-    elif animal_type and not animal_breed and not animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"animal_type": animal_type}))
-
-    # Breed selected
-    elif not animal_type and animal_breed and animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"breed": animal_breed, "sex_upon_outcome": animal_gender}))
-    elif not animal_type and animal_breed and not animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"breed": animal_breed}))
-
-    # Gender selected
-    elif not animal_type and not animal_breed and animal_gender:
-        dff = pd.DataFrame.from_records(shelter.read({"sex_upon_outcome": animal_gender}))
-
-    # Nothing selected
-    elif not animal_type and not animal_breed and not animal_gender:
-        dff = df
+    # Look up the options consistent with the dropdown choices in the facet index
+    options = facets.options(animal_type, animal_breed, animal_gender)
 
     # Define age range slider limits
-    age_min = max(int(dff['age_upon_outcome_in_weeks'].min()), 0)        # Ensure age_min is positive
-    age_max = max(int(dff['age_upon_outcome_in_weeks'].max()), age_min)  # Ensure age_max is >= age_min
+    age_min, age_max = age_limits(options)
 
-    # Define menu options by sorting the unique values for each category
-    selected_type = list(sorted(dff['animal_type'].unique()))
-    selected_breeds = list(sorted(dff['breed'].unique()))
-    selected_genders = list(sorted(dff['sex_upon_outcome'].unique()))
-    selected_type_options = [{'label': str(o), 'value': str(o)} for o in selected_type]
-    selected_breed_options = [{'label': str(o), 'value': str(o)} for o in selected_breeds]
-    selected_gender_options = [{'label': str(o), 'value': str(o)} for o in selected_genders]
+    # Define menu options by sorting the values for each category
+    selected_type_options = menu_options(options['counts']['animal_type'])
+    selected_breed_options = menu_options(options['counts']['breed'])
+    selected_gender_options = menu_options(options['counts']['sex_upon_outcome'])
 
-    # Return 0 for page number to reset table page when a selection is made
-    return selected_type_options, selected_breed_options, selected_gender_options, age_min, age_max, [age_min, age_max], 0
+    return selected_type_options, selected_breed_options, selected_gender_options, age_min, age_max, [age_min, age_max]
 
 
-# Callback to create a pie chart that displays the percentage of each breed shown in the current table view
+# Callback to create a pie chart that displays the percentage of each breed in the filtered result or table page.
+# The table page only changes the chart of the current page, so it is not sent to the server otherwise.
 @app.callback(
     Output('graph-id', "children"),
-    Input('datatable-id', "derived_viewport_data")
+    [Input('result-store', 'data'),
+     (Input if pie_chart_scope == 'page' else State)('datatable-id', 'page_current'),
+     (Input if pie_chart_scope == 'page' else State)('datatable-id', 'sort_by')],
+    [State('datatable-id', 'page_size')]
 )
-def update_graphs(view_data):
-    if view_data:
-
-        # If the table data is empty do not update chart
-        if len(view_data) == 0:
-            return
-
-        # Use table data in chart
-        dff = pd.DataFrame.from_dict(view_data)                        # Create dataframe from table data
-        dfb = dff['breed']                                             # Get breeds from current table page
-        percent = dfb.value_counts(normalize=True).mul(100).round(2)   # Compute percentage of each breed in data
-        labels = percent.index.tolist()                                # Get labels for pie chart
-        values = percent.values.tolist()                               # Get percentages for pie chart
-
-        # Keep label length fixed and set label font to courier to prevent pie chart from shifting around
-        new_labels = ["{:<40}".format(label[:40]) for label in labels]
+def update_graphs(result_store_data, page_current, sort_by, page_size):
+    if not result_store_data:
+        raise PreventUpdate
+
+    # If there are no matching animals do not show a chart
+    result = filtered_result(result_store_data['selections'])
+    if result['frame'].empty:
+        return None
+
+    # Use the breeds counted when the result was read, or count the breeds of the current table page
+    if pie_chart_scope == 'result':
+        counts = result['breeds']
+    else:
+        counts = AnimalCache.value_counts(result_page(result, page_current, page_size, sort_by), 'breed')
+
+    # Show the most common breeds and group the rest, with animals missing a breed shown as unknown
+    labels = ['Unknown' if breed is None else str(breed) for breed, count in counts[:pie_chart_top_n]]
+    values = [count for breed, count in counts[:pie_chart_top_n]]
+    if len(counts) > pie_chart_top_n:
+        labels.append('Other')
+        values.append(sum(count for breed, count in counts[pie_chart_top_n:]))
+
+    # Keep label length fixed and set label font to courier to prevent pie chart from shifting around
+    new_labels = ["{:<40}".format(label[:40]) for label in labels]
+
+    # Create plotly express pie chart
+    with metrics.timer('dashboard_step_seconds', step='pie chart'):
+        fig = px.pie(values=values, names=new_labels, hole=.4, template=pie_chart_template)
+
+    # Update title and labels
+    fig.update_layout({'title': {'text': 'Breeds',
+                                 'x': 0.305, 'xanchor': 'center',  # Center chart title horizontally
+                                 'y': 0.540, 'yanchor': 'top'},    # Center chart title vertically
+                       'font': {'color': pie_chart_text_color},    # Text color
+                       'paper_bgcolor': 'rgba(0, 0, 0, 0)',        # Make background transparent
+                       'font_family': 'Courier New'})              # Use courier font to prevent chart from shifting
+
+    # Return pie chart definition
+    return [
+       dcc.Graph(
+           figure=fig
+       )
+    ]
 
-        # Create plotly express pie chart
-        fig = px.pie(dfb, values=values, names=new_labels, hole=.4)
 
-        # Update title and labels
-        fig.update_layout({'title': {'text': 'Breeds',
-                                     'x': 0.305, 'xanchor': 'center',  # Center chart title horizontally
-                                     'y': 0.540, 'yanchor': 'top'},    # Center chart title vertically
+# Callback to update the trend charts when an animal type is selected, reading only the outcome rollups,
+# so the charts take the same time however many animals there are
+@app.callback(
+    Output('trend-id', 'children'),
+    [Input('types-dropdown', 'value')],
+    prevent_initial_call=False
+)
+@results.memoize(rollups_version)
+def update_trends(animal_type):
+    if rollups is None:
+        return None
+
+    # Count the outcomes per month of each animal type, or of each outcome of the selected animal type
+    color = 'outcome_type' if animal_type else 'animal_type'
+    with metrics.timer('dashboard_step_seconds', step='trend rollups'):
+        monthly = rollups.summary(['month', color], animal_type=animal_type)
+        ages = rollups.summary(['age_bucket', 'outcome_type'], animal_type=animal_type)
+
+    # Group the outcomes not compared by age as "Other"
+    ages['outcome_type'] = ages['outcome_type'].where(ages['outcome_type'].isin(trend_chart_outcomes), 'Other')
+    ages = ages.groupby(['age_bucket', 'outcome_type'], as_index=False)['count'].sum()
+
+    # Create plotly express line chart of the outcomes per month and bar chart of the share of each outcome by age
+    with metrics.timer('dashboard_step_seconds', step='trend charts'):
+        monthly_fig = px.line(monthly, x='month', y='count', color=color, template=trend_chart_template,
+                              labels={'month': 'Month', 'count': 'Outcomes', color: ''})
+        ages_fig = px.bar(ages, x='age_bucket', y='count', color='outcome_type', template=trend_chart_template,
+                          labels={'age_bucket': 'Age', 'count': '% of outcomes', 'outcome_type': ''},
+                          category_orders={'age_bucket': [label for bound, label in OutcomeRollups.age_buckets] +
+                                                          [OutcomeRollups.oldest_bucket,
+                                                           OutcomeRollups.unknown_bucket],
+                                           'outcome_type': trend_chart_outcomes + ['Other']})
+        ages_fig.update_layout(barnorm='percent')                         # stack the shares of each age to 100%
+
+    # Update titles and colors to match the pie chart
+    for fig, title in ((monthly_fig, 'Outcomes per month'), (ages_fig, 'Outcomes by age')):
+        fig.update_layout({'title': {'text': title},
                            'font': {'color': pie_chart_text_color},    # Text color
                            'paper_bgcolor': 'rgba(0, 0, 0, 0)',        # Make background transparent
-                           'font_family': 'Courier New'})              # Use courier font to prevent chart from shifting
+                           'plot_bgcolor': 'rgba(0, 0, 0, 0)'})
 
-        # Return pie chart definition
-        return [
-           dcc.Graph(
-               figure=fig
-           )
-        ]
+    # Return trend chart definitions
+    return [
+        dcc.Graph(figure=monthly_fig, style={'width': '50vw'}),
+        dcc.Graph(figure=ages_fig, style={'width': '45vw'})
+    ]
 
 
-# Callback to create a map showing the positions of the animals
+# Callback to update the map showing the positions of the animals.
+# The table page only changes the markers in page mode, so it is not sent to the server otherwise.
 @app.callback(
-    Output('map-id', 'children'),
-    [Input('datatable-id', "derived_viewport_data"),
-     Input('datatable-id', "derived_viewport_selected_rows")]
+    [Output('map-payload' if compact_payloads else 'map-markers', 'data'),
+     Output('map-clusters', 'children'),
+     Output('animal-map', 'center')],
+    [Input('result-store', 'data'),
+     Input('datatable-id', 'selected_rows'),
+     Input('animal-map', 'zoom'),
+     Input('animal-map', 'bounds'),
+     (Input if map_mode != 'cluster' else State)('datatable-id', 'page_current'),
+     (Input if map_mode != 'cluster' else State)('datatable-id', 'sort_by')],
+    [State('datatable-id', 'page_size')]
 )
-def update_map(data, selected_rows):
-
-    # If table is empty do not draw map
-    if len(data) == 0:
-        return
+def update_map(result_store_data, selected_rows, zoom, bounds, page_current, sort_by, page_size):
+    if not result_store_data:
+        raise PreventUpdate
+
+    # Markers from the table only change with the table, not when the map is moved,
+    # and the map is only centered on the animals when the filtered result changes
+    changed_ids = [p['prop_id'] for p in dash.callback_context.triggered]
+    recenter = any('result-store' in changed_id for changed_id in changed_ids)
+    table_changed = recenter or any('datatable-id' in changed_id for changed_id in changed_ids)
+    if (selected_rows or map_mode != 'cluster') and not table_changed:
+        raise PreventUpdate
+
+    # If there are no matching animals remove the markers
+    result = filtered_result(result_store_data['selections'])
+    dff = result['frame']
+    if dff.empty:
+        return None, [], dash.no_update
 
     # If a table row is selected, show the location of the animal on the map
-    # otherwise show the locations of all animals in the current table view
     if selected_rows:
-        # Create Pandas dataframe from selected animal data
-        dff = pd.DataFrame.from_dict(data).iloc[selected_rows]
+        return page_markers(result_page(result, page_current, page_size, sort_by).iloc[selected_rows])
+
+    # Otherwise show the locations of all animals in the current table page
+    if map_mode != 'cluster':
+        return page_markers(result_page(result, page_current, page_size, sort_by))
+
+    # or cluster all matching animals, centering the map on them when the result changes
+    # and otherwise using only the animals near the visible part of the map
+    if bounds and not recenter:
+        dff = map_layer.within(dff, map_layer.pad_bounds(bounds))
+        if dff.empty:
+            return None, [], dash.no_update
+
+    # Group nearby animals into clusters at the current zoom level
+    with metrics.timer('dashboard_step_seconds', step='map clusters'):
+        clusters, points = map_layer.cluster(dff, zoom if zoom is not None else map_zoom)
+
+    # Animals outside clusters only carry their id and name, details are read when they are clicked
+    with metrics.timer('dashboard_step_seconds', step='map geojson'):
+        geojson_markers = marker_data(points, {'id': points.index.astype(str),
+                                               'tooltip': map_layer.tooltips(points)})
+
+    # Show each cluster as a circle sized by the number of animals in it
+    circles = [dl.CircleMarker(center=[lat, lon],
+                               radius=min(10 + 3 * math.log2(count), 30),
+                               children=dl.Tooltip("{count} animals".format(count=count)))
+               for lat, lon, count in zip(clusters['location_lat'], clusters['location_long'], clusters['count'])]
+
+    # Center map within the matching animals
+    center = [0.5 * (dff['location_lat'].max() + dff['location_lat'].min()),
+              0.5 * (dff['location_long'].max() + dff['location_long'].min())] if recenter else dash.no_update
+
+    return geojson_markers, circles, center
+
+
+# Callback to show the details of an animal clicked on the map in cluster mode
+@app.callback(
+    Output('map-popup', 'children'),
+    Input('map-markers', 'click_feature')
+)
+def update_map_popup(feature):
+
+    # Animals in page mode already have their popup
+    if not feature or 'id' not in feature.get('properties', {}):
+        raise PreventUpdate
+
+    # Read the clicked animal
+    load_data()
+    animal_id = ObjectId(feature['properties']['id'])
+    if cache is not None:
+        frame = cache.frame
+        animal = frame.loc[animal_id] if animal_id in frame.index else None
     else:
-        # Create Pandas dataframe from current table data
-        dff = pd.DataFrame.from_dict(data)
-
-    # Load animal latitude and longitude
-    lats = dff['location_lat'].to_list()
-    lons = dff['location_long'].to_list()
-
-    # Load animal information
-    animal_names = dff['name'].to_list()
-    animal_types = dff['animal_type'].to_list()
-    animal_breeds = dff['breed'].to_list()
-    animal_ages = dff['age_upon_outcome_in_weeks'].to_list()
-    animal_sexes = dff['sex_upon_outcome'].to_list()
-
-    # Generate markers for each animal
-    markers = []
-    for i in range(len(lats)):
-        # Add a maker definition for each animal
-        markers += [
-            dict(lat=lats[i],
-                 lon=lons[i],
-                 tooltip=animal_names[i] if animal_names[i] else "Unnamed",
-                 # if the animal name empty replace it with "Unnamed"
-                 popup="<body><h4>Name: " + str(animal_names[i] if animal_names[i] else "Unnamed") + "</h4>"
-                       + "Type: " + str(animal_types[i]) + "<br>"
-                       + "Breed: " + str(animal_breeds[i]) + "<br>"
-                       + "Age: " + str(int(animal_ages[i])) + " weeks<br>"
-                       + "Sex: " + str(animal_sexes[i]) + "</body>"
-            )
-        ]
-
-    # Convert markers to geojson format
-    geojson_markers = dlx.dicts_to_geojson(markers)
-
-    # Return map with markers
+        animal = next(shelter.read({'_id': animal_id}), None)
+    if animal is None:
+        raise PreventUpdate
+
+    # Show the animal information at its location
     return [
-        dl.Map(style={'width': '50vw', 'height': '480px'},                     # make width 50% and height 45%
-               center=[0.5*(max(lats)+min(lats)), 0.5*(max(lons)+min(lons))],  # center map within markers
-               zoom=9,                                                         # zoom level smaller=closer
-               children=[
-                   dl.TileLayer(id="base-layer-id"),
-                   dl.GeoJSON(data=geojson_markers)]
-        )
+        dl.Popup(position=[animal['location_lat'], animal['location_long']], children=[
+            html.H4("Name: " + str(animal['name'] if animal['name'] else "Unnamed")),
+            "Type: " + str(animal['animal_type']), html.Br(),
+            "Breed: " + str(animal['breed']), html.Br(),
+            "Age: " + str(int(animal['age_upon_outcome_in_weeks'])) + " weeks", html.Br(),
+            "Sex: " + str(animal['sex_upon_outcome'])
+        ])
     ]
 
 
+# Create map markers with popups for animals from the table
+def page_markers(dff):
+
+    # Generate a marker with a popup for each animal
+    geojson_markers = marker_data(dff, {'tooltip': map_layer.tooltips(dff),
+                                        'popup': map_layer.popups(dff)})
+
+    # No clusters, and center map within markers
+    lats = dff['location_lat']
+    lons = dff['location_long']
+    return geojson_markers, [], [0.5*(lats.max()+lats.min()), 0.5*(lons.max()+lons.min())]
+
+
+# Map marker data, as compact columns or GeoJSON, from location columns and marker properties
+def marker_data(dff, properties):
+    if compact_payloads:
+        return map_layer.to_payload(dff, properties)
+    return map_layer.to_geojson(dff, properties)
+
+
+# Decode compact table and map data in the browser
+if compact_payloads:
+    app.clientside_callback(ClientsideFunction('payload', 'records'),
+                            Output('datatable-id', 'data'),
+                            Input('table-payload', 'data'))
+    app.clientside_callback(ClientsideFunction('payload', 'geojson'),
+                            Output('map-markers', 'data'),
+                            Input('map-payload', 'data'))
+
+
+# Time every callback defined above and serve the metrics on the /metrics route
+metrics.instrument(app)
+
+
 if __name__ == '__main__':
     app.run_server(debug=False)
\ No newline at end of file